@@ -0,0 +1,382 @@
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+import metrics
+from landmarks import (
+    COLUMNS, LEFT_INDEX, LEFT_PINKY, LEFT_THUMB, LEFT_WRIST, NOSE, VISIBILITY, X, Y, Z, Landmarks)
+from pose_estimator import PoseEstimator
+
+#Load test for the FastAPI server without models or photos: the app runs in a child process with a stub
+#PoseEstimator that sleeps for a set latency per model and returns canned landmarks, while this process drives the
+#measurement endpoints over HTTP at a fixed concurrency and reports throughput, latency percentiles and memory.
+#Everything but the models is real (HTTP, JSON/base64 or multipart, decoding, queueing, batching, caching), so
+#regressions in those layers show up here. Example:
+#   python benchmark.py --requests 400 --concurrency 16 --mix lumbar=2,tragusleft=1 --wholebody-ms 250
+#   python benchmark.py --cascade --escalate 0.2
+
+#Image fields of each measurement endpoint, as in main.MEASUREMENTS
+ENDPOINT_FIELDS = {
+    "tragusleft": ("image",),
+    "tragusright": ("image",),
+    "flexionleft": ("image1", "image2"),
+    "rights": ("image1", "image2"),
+    "lumbar": ("image1", "image2"),
+    "cervicalleft": ("image1", "image2"),
+    "cright": ("image1", "image2"),
+    "intermalleolar": ("image",),
+}
+
+#Normalised (x, y) of the 33 MediaPipe landmarks for a person standing facing the camera
+STANDING_LANDMARKS = [
+    (0.50, 0.12), (0.49, 0.11), (0.49, 0.11), (0.48, 0.11), (0.51, 0.11), (0.51, 0.11), (0.52, 0.11),
+    (0.47, 0.12), (0.53, 0.12), (0.49, 0.14), (0.51, 0.14), (0.44, 0.22), (0.56, 0.22), (0.42, 0.35),
+    (0.58, 0.35), (0.41, 0.47), (0.59, 0.47), (0.41, 0.50), (0.59, 0.50), (0.41, 0.51), (0.59, 0.51),
+    (0.42, 0.49), (0.58, 0.49), (0.46, 0.50), (0.54, 0.50), (0.46, 0.70), (0.54, 0.70), (0.46, 0.88),
+    (0.54, 0.88), (0.46, 0.90), (0.54, 0.90), (0.45, 0.92), (0.55, 0.92),
+]
+
+#PoseEstimator whose models are replaced by sleeps, latencies in seconds per model. The canned pose changes a
+#little on every call (head turn, hand height) so the measurement maths runs on realistic, non-degenerate input.
+#In cascade mode the lite landmarker's pose has low visibility on the escalate fraction of calls
+class StubPoseEstimator(PoseEstimator):
+    def __init__(self, latencies, batch_max_size=1, batch_window=0.0, cache_bytes=0, cascade=False, escalate=0.0):
+        self.latencies = latencies
+        self.calls = itertools.count()
+        self.escalate = escalate
+        self.escalations = random.Random(0)
+        super().__init__(batch_max_size, batch_window, cache_bytes, lazy=True, cascade=cascade)
+
+    def load(self):
+        pass
+
+    def warm_up(self, top_down=True):
+        pass
+
+    def canned_landmarks(self, visibility=1.0):
+        call = next(self.calls)
+        turn = math.radians(call % 8 * 10)
+        drop = call % 5 * 0.02
+        landmarks = np.zeros((len(STANDING_LANDMARKS), COLUMNS), dtype=np.float32)
+        landmarks[:, :2] = STANDING_LANDMARKS
+        landmarks[[LEFT_WRIST, LEFT_PINKY, LEFT_INDEX, LEFT_THUMB], Y] += drop
+        landmarks[:, VISIBILITY:] = visibility
+        world_landmarks = landmarks.copy()
+        world_landmarks[:, :2] = (landmarks[:, :2] - 0.5) * 1.8
+        world_landmarks[NOSE, X] = 0.1 * math.sin(turn)
+        world_landmarks[NOSE, Z] = -0.1 * math.cos(turn)
+        return Landmarks(landmarks), Landmarks(world_landmarks)
+
+    def canned_wholebody(self):
+        drop = next(self.calls) % 5 * 20
+        keypoints = [[300.0 + index % 10 * 5, 100.0 + index * 6] for index in range(133)]
+        keypoints[14], keypoints[16] = [320.0, 700.0], [320.0, 880.0]
+        keypoints[18], keypoints[21] = [310.0, 920.0], [330.0, 920.0]
+        keypoints[104], keypoints[125] = [300.0, 500.0 + drop], [340.0, 500.0 + drop]
+        return keypoints
+
+    def canned_human3d(self):
+        tuck = next(self.calls) % 5 * 0.01
+        keypoints = [[0.0, 0.0, index * 0.01] for index in range(17)]
+        keypoints[8] = [0.0, -0.5, 0.05]
+        keypoints[10] = [0.0, -0.7, 0.12 - tuck]
+        return keypoints
+
+    def run_media_pipe(self, pixels, lite=False):
+        if lite:
+            with metrics.stage('mediapipe-lite'), self.lite_lock:
+                time.sleep(self.latencies["mediapipe-lite"])
+            return self.canned_landmarks(0.2 if self.escalations.random() < self.escalate else 1.0)
+        with metrics.stage('mediapipe'), self.mediapipe_lock:
+            time.sleep(self.latencies["mediapipe"])
+        return self.canned_landmarks()
+
+    def run_person_detector(self, pixels):
+        with metrics.stage('person'), self.person_lock:
+            time.sleep(self.latencies["person"])
+        return [200.0, 50.0, 440.0, 980.0, 0.9]
+
+    def run_wholebody(self, pixels, box=None):
+        if box is None:
+            box = self.person_box(pixels)
+        if self.wholebody_batcher:
+            with metrics.stage('wholebody'):
+                return self.wholebody_batcher((pixels, box))
+        with metrics.stage('wholebody'), self.wholebody_lock:
+            time.sleep(self.latencies["wholebody"])
+        return self.canned_wholebody()
+
+    def run_human3d(self, pixels, box=None):
+        if box is None:
+            box = self.person_box(pixels)
+        with metrics.stage('human3d'), self.human3d_lock:
+            time.sleep(self.latencies["human3d"])
+        return self.canned_human3d()
+
+    #One simulated forward pass per batch, like the real batched wholebody
+    def wholebody_inference_batch(self, items):
+        with self.wholebody_lock:
+            time.sleep(self.latencies["wholebody"])
+        return [self.canned_wholebody() for _ in items]
+
+#Child process: runs the real app with the stub estimator in place of the models
+def serve(port, latencies, cascade, escalate):
+    #Nothing to load, and no history written unless the environment asks for it
+    os.environ['BASMI_STARTUP_MODE'] = 'lazy'
+    os.environ.setdefault('BASMI_STORE_PATH', '')
+
+    import uvicorn
+
+    import config
+    import main
+
+    main.estimator = StubPoseEstimator(
+        latencies, config.BATCH_MAX_SIZE, config.BATCH_WINDOW_MS / 1000, config.CACHE_BYTES, cascade, escalate)
+    main.router.measure_with(main.estimator)
+    uvicorn.run(main.app, host='127.0.0.1', port=port, log_level='warning')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+#Synthetic photos, a smooth gradient with some noise so they compress like camera images, output: JPEG bytes
+def make_images(count, width, height, seed):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        gradient = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+        pixels = gradient + rng.normal(0, 12, (height, width, 3)).astype(np.float32) + rng.uniform(-60, 60, 3)
+        buffer = BytesIO()
+        Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buffer, 'JPEG', quality=85)
+        images.append(buffer.getvalue())
+    return images
+
+#Builds the request for an endpoint, output: (path, body, headers)
+def build_request(endpoint, fields, images, transport):
+    if transport == 'json':
+        body = json.dumps({field: base64.b64encode(image).decode() for field, image in zip(fields, images)}).encode()
+        return f'/{endpoint}', body, {'Content-Type': 'application/json'}
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for field, image in zip(fields, images):
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{field}.jpg"\r\n'
+            f'Content-Type: image/jpeg\r\n\r\n'.encode() + image + b'\r\n')
+    body = b''.join(parts) + f'--{boundary}--\r\n'.encode()
+    return f'/upload/{endpoint}', body, {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+
+def percentile(values, percent):
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))]
+
+def summarise(latencies):
+    latencies = sorted(latencies)
+    return {
+        "count": len(latencies),
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "p50_ms": percentile(latencies, 50) * 1000 if latencies else None,
+        "p95_ms": percentile(latencies, 95) * 1000 if latencies else None,
+        "p99_ms": percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+#Resident and peak resident memory of a process in MiB, Linux only
+def process_memory(pid):
+    try:
+        with open(f'/proc/{pid}/status') as status:
+            fields = dict(line.split(':', 1) for line in status if ':' in line)
+    except OSError:
+        return None
+    return {
+        "rss_mib": int(fields['VmRSS'].split()[0]) / 1024,
+        "peak_rss_mib": int(fields['VmHWM'].split()[0]) / 1024,
+    }
+
+#Kept and escalated counts of cascade mode from the server's /metrics, output: dict of result -> count
+def cascade_counts(port):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', '/metrics')
+    counts = {"kept": 0, "escalated": 0}
+    for line in connection.getresponse().read().decode().splitlines():
+        for result in counts:
+            if line.startswith(f'basmi_cascade_inferences_total{{result="{result}"}}'):
+                counts[result] = int(float(line.split()[-1]))
+    connection.close()
+    return counts
+
+def wait_until_ready(port, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/readyz')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"Server did not become ready within {timeout} seconds")
+
+#Sends the planned requests from concurrency threads, each keeping one connection open,
+#output: list of (endpoint, HTTP status, measurement status, seconds) and the wall time taken
+def drive(port, plan, requests, concurrency):
+    results = []
+    lock = threading.Lock()
+    positions = itertools.count()
+
+    def worker():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+        while True:
+            position = next(positions)
+            if position >= len(plan):
+                break
+            endpoint, path, body, headers = requests[plan[position]]
+            start = time.perf_counter()
+            try:
+                connection.request('POST', path, body, headers)
+                response = connection.getresponse()
+                payload = response.read()
+                status = response.status
+                measured = json.loads(payload).get('status') if status == 200 else None
+            except (OSError, http.client.HTTPException, ValueError):
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=300)
+                status, measured = 0, None
+            elapsed = time.perf_counter() - start
+            with lock:
+                results.append((endpoint, status, measured, elapsed))
+        connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - start
+
+def parse_mix(text):
+    mix = {}
+    for item in text.split(','):
+        endpoint, _, weight = item.partition('=')
+        if endpoint not in ENDPOINT_FIELDS:
+            raise argparse.ArgumentTypeError(f"Unknown endpoint {endpoint}, choose from {', '.join(ENDPOINT_FIELDS)}")
+        mix[endpoint] = float(weight or 1)
+    return mix
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the measurement endpoints against a stub PoseEstimator")
+    parser.add_argument('--requests', type=int, default=200, help="requests to send in total")
+    parser.add_argument('--concurrency', type=int, default=8, help="requests in flight at once")
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(','.join(ENDPOINT_FIELDS)),
+                        help="endpoint=weight list, e.g. lumbar=2,tragusleft=1 (default: all eight equally)")
+    parser.add_argument('--transport', choices=('json', 'upload'), default='json',
+                        help="base64 JSON endpoints or binary multipart /upload endpoints")
+    parser.add_argument('--mediapipe-ms', type=float, default=30, help="simulated MediaPipe latency")
+    parser.add_argument('--lite-ms', type=float, default=12, help="simulated lite MediaPipe latency (cascade mode)")
+    parser.add_argument('--cascade', action='store_true', help="run MediaPipe as a lite then full cascade")
+    parser.add_argument('--escalate', type=float, default=0.2,
+                        help="fraction of lite landmarker results with low visibility in cascade mode")
+    parser.add_argument('--person-ms', type=float, default=40, help="simulated person detector latency")
+    parser.add_argument('--wholebody-ms', type=float, default=150, help="simulated wholebody latency")
+    parser.add_argument('--human3d-ms', type=float, default=300, help="simulated human3d latency")
+    parser.add_argument('--images', type=int, default=8, help="distinct synthetic photos to cycle through")
+    parser.add_argument('--width', type=int, default=3024)
+    parser.add_argument('--height', type=int, default=4032)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    latencies = {
+        "mediapipe": args.mediapipe_ms / 1000,
+        "mediapipe-lite": args.lite_ms / 1000,
+        "person": args.person_ms / 1000,
+        "wholebody": args.wholebody_ms / 1000,
+        "human3d": args.human3d_ms / 1000,
+    }
+    images = make_images(args.images, args.width, args.height, args.seed)
+    rng = random.Random(args.seed)
+
+    #Every endpoint/image combination is encoded once up front so the client costs little during the run
+    requests = []
+    for endpoint in args.mix:
+        fields = ENDPOINT_FIELDS[endpoint]
+        for offset in range(len(images)):
+            chosen = [images[(offset + index) % len(images)] for index in range(len(fields))]
+            requests.append((endpoint, *build_request(endpoint, fields, chosen, args.transport)))
+    weights = [args.mix[endpoint] for endpoint, *_ in requests]
+    plan = rng.choices(range(len(requests)), weights=weights, k=args.requests)
+
+    port = free_port()
+    server = multiprocessing.get_context('spawn').Process(target=serve, args=(port, latencies, args.cascade, args.escalate), daemon=True)
+    server.start()
+    try:
+        wait_until_ready(port, 60)
+        idle_memory = process_memory(server.pid)
+        results, wall = drive(port, plan, requests, args.concurrency)
+        memory = process_memory(server.pid)
+        cascade = cascade_counts(port) if args.cascade else None
+    finally:
+        server.terminate()
+        server.join()
+
+    succeeded = [elapsed for _, status, measured, elapsed in results if status == 200 and measured == 'success']
+    report = {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "transport": args.transport,
+        "image_size": [args.width, args.height],
+        "wall_seconds": wall,
+        "throughput_rps": len(succeeded) / wall if wall else None,
+        "succeeded": len(succeeded),
+        "rejected": sum(1 for _, status, _, _ in results if status == 503),
+        "failed": len(results) - len(succeeded) - sum(1 for _, status, _, _ in results if status == 503),
+        "latency": summarise([elapsed for *_, elapsed in results]),
+        "endpoints": {
+            endpoint: summarise([elapsed for name, _, _, elapsed in results if name == endpoint])
+            for endpoint in args.mix
+        },
+        "server_memory_idle": idle_memory,
+        "server_memory": memory,
+        "cascade": cascade,
+    }
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print(f"{report['requests']} requests, concurrency {args.concurrency}, {args.transport}, "
+          f"{args.width}x{args.height} images, {wall:.2f}s")
+    print(f"throughput {report['throughput_rps']:.1f} req/s, {report['succeeded']} succeeded, "
+          f"{report['rejected']} rejected (503), {report['failed']} failed")
+    print(f"{'endpoint':<16}{'count':>7}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for endpoint, stats in list(report["endpoints"].items()) + [("all", report["latency"])]:
+        if stats["count"]:
+            print(f"{endpoint:<16}{stats['count']:>7}{stats['mean_ms']:>10.1f}{stats['p50_ms']:>10.1f}"
+                  f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    if cascade:
+        ran = cascade["kept"] + cascade["escalated"]
+        print(f"cascade: {cascade['escalated']} of {ran} lite landmarker runs escalated "
+              f"({cascade['escalated'] / ran if ran else 0:.0%})")
+    if memory:
+        print(f"server memory: {idle_memory['rss_mib']:.0f} MiB idle, {memory['rss_mib']:.0f} MiB after the run, "
+              f"{memory['peak_rss_mib']:.0f} MiB peak")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import os
+
+#Backend settings, read from environment variables so each deployment can be tuned without editing code
+
+#Number of worker threads running PoseEstimator inference outside pool mode, per model pool unless set for the pool
+#below
+INFERENCE_WORKERS = int(os.environ.get('BASMI_INFERENCE_WORKERS', '2'))
+#Number of requests allowed to wait for a free worker before new requests are rejected, per model pool likewise
+INFERENCE_QUEUE_SIZE = int(os.environ.get('BASMI_INFERENCE_QUEUE_SIZE', '8'))
+#Seconds a rejected client is asked to wait before retrying
+RETRY_AFTER_SECONDS = int(os.environ.get('BASMI_RETRY_AFTER_SECONDS', '2'))
+
+#Number of forked worker processes sharing the preloaded models, in total across the model pools below (each pool
+#gets at least one), 0 runs inference in this process
+POOL_PROCESSES = int(os.environ.get('BASMI_POOL_PROCESSES', '0'))
+#Threads each worker process may use inside PyTorch/OpenCV/ONNX Runtime, keeps N workers from oversubscribing the cores
+THREADS_PER_PROCESS = int(os.environ.get('BASMI_THREADS_PER_PROCESS', '1'))
+
+#Requests run on the pool of the slowest model their measurements need, each pool with its own workers (one forked
+#process each in pool mode) and waiting queue, so MediaPipe-only requests never wait behind wholebody or human3d.
+#In pool mode POOL_PROCESSES is split evenly between the pools, any remainder going to the slowest models first
+POOL_MODELS = ('mediapipe', 'wholebody', 'human3d')
+POOL_SHARE, POOL_REMAINDER = divmod(POOL_PROCESSES, len(POOL_MODELS))
+MODEL_POOLS = {
+    model: (
+        int(os.environ.get(f'BASMI_{model.upper()}_WORKERS', str(
+            max(1, POOL_SHARE + (len(POOL_MODELS) - 1 - index < POOL_REMAINDER))
+            if POOL_PROCESSES else INFERENCE_WORKERS))),
+        int(os.environ.get(f'BASMI_{model.upper()}_QUEUE_SIZE', str(INFERENCE_QUEUE_SIZE))),
+    )
+    for index, model in enumerate(POOL_MODELS)
+}
+
+#Inference profile: 'fast' (MediaPipe's lite landmarker), 'balanced' (full) or 'accurate' (heavy), recorded with each
+#stored result, see pose_estimator.PROFILES
+INFERENCE_PROFILE = os.environ.get('BASMI_INFERENCE_PROFILE', 'balanced')
+
+#Cascade mode ('1' to enable): MediaPipe runs the lite landmarker first and re-runs with the profile's landmarker only
+#when a landmark the measurement reads has visibility or presence below the threshold, basmi_cascade_inferences_total
+#counts kept and escalated images. Needs the balanced or accurate profile
+CASCADE = os.environ.get('BASMI_CASCADE', '0') == '1'
+CASCADE_THRESHOLD = float(os.environ.get('BASMI_CASCADE_THRESHOLD', '0.5'))
+
+#Runtime of the wholebody and human3d models: 'mmpose' (PyTorch) or 'onnx' (ONNX Runtime on models exported by
+#export_onnx.py, no PyTorch/mmcv needed at run time)
+POSE_BACKEND = os.environ.get('BASMI_POSE_BACKEND', 'mmpose')
+#Directory holding the exported ONNX models
+ONNX_MODEL_DIR = os.environ.get('BASMI_ONNX_MODEL_DIR', 'onnx')
+#Threads per ONNX Runtime session outside pool mode, 0 uses every core
+ONNX_THREADS = int(os.environ.get('BASMI_ONNX_THREADS', '0'))
+#Precision of the ONNX pose models: 'float', or 'int8' for the quantized models from export_onnx.py quantize, faster
+#on the CPU at a small accuracy cost, see export_onnx.py drift for how far each measurement moves
+ONNX_PROFILE = os.environ.get('BASMI_ONNX_PROFILE', 'float')
+
+#ROI crop mode ('1' to enable): wholebody runs lumbar flexion from a box around the landmarks it reads, located with
+#MediaPipe, instead of the person detector's box, and the margin added on every side as a fraction of the box's
+#longest side. human3d always runs from the person detector's box, its lifter normalises by that box
+ROI_CROP = os.environ.get('BASMI_ROI_CROP', '0') == '1'
+ROI_MARGIN = float(os.environ.get('BASMI_ROI_MARGIN', '0.15'))
+
+#Largest number of concurrent wholebody requests run as one batch, 1 disables micro-batching. Capped at the worker
+#threads that can run wholebody at once (the wholebody and human3d pools), a larger batch can never fill and every
+#call would wait out the window. Forked workers in pool mode run one request at a time and never batch
+BATCH_MAX_SIZE = min(
+    int(os.environ.get('BASMI_BATCH_MAX_SIZE', '1')), MODEL_POOLS['wholebody'][0] + MODEL_POOLS['human3d'][0])
+#Milliseconds the first request of a batch waits for others to join
+BATCH_WINDOW_MS = float(os.environ.get('BASMI_BATCH_WINDOW_MS', '10'))
+
+#Largest request body accepted by the binary upload endpoints, in bytes
+MAX_UPLOAD_BYTES = int(os.environ.get('BASMI_MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+
+#Memory budget in bytes for cached landmarks/keypoints keyed by image content, 0 disables the cache
+CACHE_BYTES = int(os.environ.get('BASMI_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+#How models are loaded: 'eager' before the server binds, 'background' on a thread after it binds,
+#'lazy' on first use by a request
+STARTUP_MODE = os.environ.get('BASMI_STARTUP_MODE', 'eager')
+#Run one synthetic inference per model after loading ('0' to skip)
+WARM_UP = os.environ.get('BASMI_WARM_UP', '1') != '0'
+
+#Jobs submitted through /jobs allowed to wait for a runner before new submissions are rejected
+JOB_QUEUE_SIZE = int(os.environ.get('BASMI_JOB_QUEUE_SIZE', '32'))
+#Seconds a finished job's result is kept for the client to fetch
+JOB_RETENTION_SECONDS = float(os.environ.get('BASMI_JOB_RETENTION_SECONDS', '600'))
+#Largest number of finished jobs kept at once, the oldest are dropped first
+JOB_MAX_RETAINED = int(os.environ.get('BASMI_JOB_MAX_RETAINED', '256'))
+
+#Longest side in pixels uploads are reduced to while decoding (JPEGs at 1/2, 1/4 or 1/8 scale in the DCT, never
+#below this), 0 decodes at full size. Geometry is still reported in the original image's coordinates. Images human3d
+#runs on (tragus to wall) are always decoded at full size, its lifter's output scales with the image width
+DECODE_MAX_SIDE = int(os.environ.get('BASMI_DECODE_MAX_SIDE', '960'))
+
+#Largest video accepted by the /video endpoints, in bytes
+MAX_VIDEO_BYTES = int(os.environ.get('BASMI_MAX_VIDEO_BYTES', str(100 * 1024 * 1024)))
+#Frames per second sampled by the quick pose pass over a video, and the longest side they are reduced to
+VIDEO_SCAN_FPS = float(os.environ.get('BASMI_VIDEO_SCAN_FPS', '5'))
+VIDEO_SCAN_SIDE = int(os.environ.get('BASMI_VIDEO_SCAN_SIDE', '256'))
+#Seconds of video read at most, anything after is ignored
+VIDEO_MAX_SECONDS = float(os.environ.get('BASMI_VIDEO_MAX_SECONDS', '30'))
+#Gap in frames between sampled frames from which the scan seeks instead of decoding every frame in between, 0 never
+#seeks. A seek decodes from the keyframe before the target, so keep this above the clips' keyframe interval
+VIDEO_SEEK_FRAMES = int(os.environ.get('BASMI_VIDEO_SEEK_FRAMES', '60'))
+
+#SQLite file keeping the history of results sent with an X-Patient-Id header, e.g. measurements.db. Empty (the
+#default) disables the store: /history serves the stored results and landmark summaries without authentication, so
+#keeping health data is left to the deployment to turn on
+STORE_PATH = os.environ.get('BASMI_STORE_PATH', '')
+#Most results written in one transaction, and seconds the writer waits for more before committing
+STORE_BATCH_SIZE = int(os.environ.get('BASMI_STORE_BATCH_SIZE', '256'))
+STORE_FLUSH_MS = float(os.environ.get('BASMI_STORE_FLUSH_MS', '50'))
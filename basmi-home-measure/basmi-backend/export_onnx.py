@@ -0,0 +1,306 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import config
+import onnx_backend
+from image_io import load_image
+from measurement_registry import MEASUREMENTS, evaluate
+from pose_estimator import PoseEstimator
+
+#Exports the MMPose models behind wholebody and human3d to ONNX for the 'onnx' pose backend, and checks the ONNX
+#Runtime pipeline against MMPose on a folder of photos. Exporting and checking need PyTorch, mmcv, mmdet and mmpose,
+#serving the exported models does not. The int8 profile is made by quantizing the exported pose models with
+#calibration photos, and its drift report shows how far each BASMI measurement moves from the float models. Example:
+#   python export_onnx.py export --output onnx
+#   python export_onnx.py parity --images photos/ --onnx-dir onnx
+#   python export_onnx.py quantize --images calibration/ --onnx-dir onnx
+#   python export_onnx.py drift --images photos/ --onnx-dir onnx
+
+#Image extensions read from the photo folder
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+#Keypoints the BASMI measurements read from each model's output
+MEASURED_KEYPOINTS = {
+    model: sorted({
+        index for measurement in MEASUREMENTS.values() for reads in measurement.images
+        for index in reads.get(model, ())
+    })
+    for model in ("wholebody", "human3d")
+}
+
+#Runs a pose model's tensor forward pass (backbone and head, no decoding) with flat tensor outputs, which is the part
+#exported to ONNX, onnx_backend does the rest in NumPy
+def tensor_module(model):
+    import torch
+
+    class TensorForward(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, inputs):
+            outputs = self.model(inputs, None, mode='tensor')
+            #RTMDet returns per level class scores and box distances, flattened into one output per level
+            if isinstance(outputs, tuple) and isinstance(outputs[0], (tuple, list)):
+                return tuple(output for level_outputs in outputs for output in level_outputs)
+            return outputs
+
+    return TensorForward().cpu().eval()
+
+#Exports one model with a dynamic batch dimension, input: model, example input shape, output file, output names
+def export_model(model, shape, path, output_names, opset):
+    import torch
+
+    dynamic_axes = {name: {0: 'batch'} for name in ['input'] + output_names}
+    with torch.no_grad():
+        torch.onnx.export(
+            tensor_module(model), torch.zeros(shape), path, input_names=['input'], output_names=output_names,
+            dynamic_axes=dynamic_axes, opset_version=opset)
+    print(f"exported {path}")
+
+#Exports the detector, both top-down models and the lifter from the checkpoints the aliases PoseEstimator uses
+#resolve to
+def export(output, opset):
+    from mmpose.apis import MMPoseInferencer
+
+    os.makedirs(output, exist_ok=True)
+    wholebody = MMPoseInferencer('wholebody').inferencer
+    human3d = MMPoseInferencer(pose3d='human3d').inferencer
+    pose_shape = (1, 3, onnx_backend.POSE_SIZE[1], onnx_backend.POSE_SIZE[0])
+    strides = onnx_backend.DETECTOR_STRIDES
+
+    #wholebody and human3d share the same person detector, it is exported once
+    export_model(
+        wholebody.detector.model, (1, 3, onnx_backend.DETECTOR_SIZE, onnx_backend.DETECTOR_SIZE),
+        os.path.join(output, onnx_backend.DETECTOR_FILE),
+        [f'scores_{stride}' for stride in strides] + [f'boxes_{stride}' for stride in strides], opset)
+    export_model(
+        wholebody.model, pose_shape, os.path.join(output, onnx_backend.WHOLEBODY_FILE), ['simcc_x', 'simcc_y'], opset)
+    export_model(
+        human3d.pose2d_model.model, pose_shape, os.path.join(output, onnx_backend.HUMAN_FILE),
+        ['simcc_x', 'simcc_y'], opset)
+    #One frame of 17 keypoints (x, y, visibility), as Pose3DInferencer lifts single images
+    export_model(human3d.model, (1, 1, 17, 3), os.path.join(output, onnx_backend.LIFTER_FILE), ['keypoints'], opset)
+
+#Photos in a folder, in name order
+def image_paths(folder):
+    return sorted(
+        os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_EXTENSIONS))
+
+#Decodes a photo the way the server decodes uploads for the given models, at full size for human3d
+def load_photo(path, models=()):
+    return load_image(path, None if "human3d" in models else config.DECODE_MAX_SIDE)
+
+#Runs one model of an estimator on an image, output: (keypoints array, seconds taken)
+def timed_run(estimator, model, pixels):
+    run = estimator.run_wholebody if model == "wholebody" else estimator.run_human3d
+    start = time.perf_counter()
+    keypoints = run(pixels)
+    return np.asarray(keypoints, dtype=np.float64), time.perf_counter() - start
+
+#Compares a candidate estimator's wholebody/human3d keypoints with a reference estimator's, image by image,
+#output: report dict per model
+def compare(reference, candidate, paths):
+    report = {}
+    for model in ("wholebody", "human3d"):
+        errors, measured_errors, tragus_differences = [], [], []
+        reference_seconds, candidate_seconds = [], []
+        for path in paths:
+            pixels = load_photo(path, (model,))
+            expected, elapsed = timed_run(reference, model, pixels)
+            reference_seconds.append(elapsed)
+            actual, elapsed = timed_run(candidate, model, pixels)
+            candidate_seconds.append(elapsed)
+
+            error = np.linalg.norm(actual - expected, axis=1)
+            errors.append(error.max())
+            measured_errors.append(error[MEASURED_KEYPOINTS[model]].max())
+            if model == "human3d":
+                tragus = [
+                    evaluate({"tragus_to_wall_left": [0]}, [{"shape": pixels.shape[:2], "human3d": keypoints}])
+                    for keypoints in (expected, actual)
+                ]
+                tragus_differences.append(abs(tragus[0]["tragus_to_wall_left"] - tragus[1]["tragus_to_wall_left"]))
+
+        report[model] = {
+            #Pixels for wholebody, metres for human3d
+            "max_error": float(max(errors)),
+            "mean_error": float(np.mean(errors)),
+            "max_measured_error": float(max(measured_errors)),
+            #The first image pays one-time initialisation, it is left out of the timings
+            "reference_ms": 1000 * float(np.mean(reference_seconds[1:] or reference_seconds)),
+            "candidate_ms": 1000 * float(np.mean(candidate_seconds[1:] or candidate_seconds)),
+        }
+        if tragus_differences:
+            report[model]["max_tragus_difference_cm"] = float(max(tragus_differences))
+    return report
+
+#Checks the ONNX Runtime backend against MMPose, output: True when every measured keypoint is within tolerance
+def parity(folder, onnx_dir, threads, pixel_tolerance, metre_tolerance):
+    paths = image_paths(folder)
+    if not paths:
+        raise SystemExit(f"No images in {folder}")
+    reference = PoseEstimator(lazy=True)
+    candidate = PoseEstimator(lazy=True, backend='onnx', onnx_dir=onnx_dir, onnx_threads=threads)
+    report = compare(reference, candidate, paths)
+    report["images"] = len(paths)
+    print(json.dumps(report, indent=2))
+    return (report["wholebody"]["max_measured_error"] <= pixel_tolerance
+            and report["human3d"]["max_measured_error"] <= metre_tolerance)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the MMPose models to ONNX and check the ONNX backend")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = commands.add_parser('export', help="export the detector, pose and lifter models")
+    export_parser.add_argument('--output', default='onnx', help="directory to write the models to")
+    export_parser.add_argument('--opset', type=int, default=17)
+
+    parity_parser = commands.add_parser('parity', help="compare ONNX Runtime keypoints with MMPose on photos")
+    parity_parser.add_argument('--images', required=True, help="folder of photos of a person")
+    parity_parser.add_argument('--onnx-dir', default='onnx')
+    parity_parser.add_argument('--threads', type=int, default=0, help="ONNX Runtime threads, 0 uses every core")
+    parity_parser.add_argument('--pixel-tolerance', type=float, default=2.0,
+                               help="largest wholebody keypoint difference allowed, in pixels")
+    parity_parser.add_argument('--metre-tolerance', type=float, default=0.01,
+                               help="largest human3d keypoint difference allowed, in metres")
+    quantize_parser = commands.add_parser('quantize', help="write the int8 profile of the pose models")
+    quantize_parser.add_argument('--images', help="folder of calibration photos, needed for static quantization")
+    quantize_parser.add_argument('--onnx-dir', default='onnx')
+    quantize_parser.add_argument('--mode', choices=('static', 'dynamic'), default='static')
+    quantize_parser.add_argument('--method', choices=('MinMax', 'Entropy', 'Percentile'), default='MinMax',
+                                 help="how static quantization sets activation ranges from the calibration photos")
+    quantize_parser.add_argument('--reduce-range', action='store_true',
+                                 help="7-bit weights, for x86 CPUs without VNNI")
+    quantize_parser.add_argument('--threads', type=int, default=0)
+
+    drift_parser = commands.add_parser('drift', help="report how far each measurement moves in a quantized profile")
+    drift_parser.add_argument('--images', required=True,
+                              help="folder of photos, paired in name order as before/after for lumbar flexion")
+    drift_parser.add_argument('--onnx-dir', default='onnx')
+    drift_parser.add_argument('--profile', choices=onnx_backend.PROFILES[1:], default='int8')
+    drift_parser.add_argument('--threads', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args.output, args.opset)
+    elif args.command == 'quantize':
+        quantize(args.onnx_dir, args.images, args.mode, args.method, args.reduce_range, args.threads)
+    elif args.command == 'drift':
+        drift(args.images, args.onnx_dir, args.profile, args.threads)
+    elif not parity(args.images, args.onnx_dir, args.threads, args.pixel_tolerance, args.metre_tolerance):
+        print("ONNX keypoints differ from MMPose beyond the tolerance", file=sys.stderr)
+        sys.exit(1)
+
+#Iterates over recorded model inputs for ONNX Runtime's calibration
+class CalibrationReader:
+    def __init__(self, input_name, batches):
+        self.input_name = input_name
+        self.batches = iter(batches)
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        return None if batch is None else {self.input_name: batch}
+
+#Inputs the float pipeline feeds each quantized model on the calibration photos, mirrored crops included, output:
+#dict of model file -> list of input batches
+def calibration_inputs(onnx_dir, paths, threads):
+    estimator = PoseEstimator(lazy=True, backend='onnx', onnx_dir=onnx_dir, onnx_threads=threads)
+    detector = estimator.load_person_detector()
+    wholebody = estimator.load_wholebody()
+    human3d = estimator.load_human3d()
+    inputs = {file_name: [] for file_name in onnx_backend.QUANTIZED_FILES}
+    for path in paths:
+        pixels = load_photo(path)
+        boxes = detector.detect([pixels])
+        inputs[onnx_backend.WHOLEBODY_FILE].append(wholebody.pose.prepare([pixels], boxes)[0])
+        inputs[onnx_backend.HUMAN_FILE].append(human3d.pose.prepare([pixels], boxes)[0])
+        keypoints, _ = human3d.pose.predict([pixels], boxes)
+        inputs[onnx_backend.LIFTER_FILE].append(human3d.lifter.prepare(
+            onnx_backend.coco_to_h36m(keypoints), boxes, np.array([pixels.shape[:2]])))
+    return inputs
+
+#Writes the int8 profile next to the float models. Static quantization calibrates activation ranges on the photos
+#(QDQ, unsigned 8-bit activations, signed 8-bit per-channel weights), dynamic quantization only needs the weights
+def quantize(onnx_dir, folder, mode, method, reduce_range, threads):
+    from onnxruntime import quantization
+
+    paths = image_paths(folder) if mode == 'static' else []
+    if mode == 'static' and not paths:
+        raise SystemExit(f"No calibration images in {folder}")
+    inputs = calibration_inputs(onnx_dir, paths, threads) if paths else {}
+
+    for file_name in onnx_backend.QUANTIZED_FILES:
+        source = os.path.join(onnx_dir, file_name)
+        target = os.path.join(onnx_dir, onnx_backend.profile_file(file_name, 'int8'))
+        #Shape inference and graph clean-up first, as ONNX Runtime recommends before quantizing
+        with tempfile.TemporaryDirectory() as directory:
+            prepared = os.path.join(directory, file_name)
+            quantization.quant_pre_process(source, prepared)
+            if mode == 'dynamic':
+                quantization.quantize_dynamic(
+                    prepared, target, weight_type=quantization.QuantType.QInt8, reduce_range=reduce_range)
+            else:
+                input_name = onnx_backend.create_session(prepared, threads).get_inputs()[0].name
+                quantization.quantize_static(
+                    prepared, target, CalibrationReader(input_name, inputs[file_name]),
+                    quant_format=quantization.QuantFormat.QDQ, per_channel=True, reduce_range=reduce_range,
+                    activation_type=quantization.QuantType.QUInt8, weight_type=quantization.QuantType.QInt8,
+                    calibrate_method=getattr(quantization.CalibrationMethod, method))
+        print(f"quantized {target}")
+
+#How far each BASMI measurement moves between two estimators, input: photos, output: dict of measurement name ->
+#{mean, max} absolute difference in the measurement's unit. Photos are grouped in name order into the images each
+#measurement takes (before/after pairs for the two image measurements), and both estimators measure them the way the
+#server does. Photos without a measurable pose are left out
+def measurement_drift(reference, candidate, paths):
+    photos = {}
+    drift = {}
+    for name, measurement in MEASUREMENTS.items():
+        if not measurement.uses & {"wholebody", "human3d"}:
+            #MediaPipe measurements do not run the quantized models
+            drift[name] = {"mean": 0.0, "max": 0.0, "samples": 0}
+            continue
+
+        full_size = "human3d" in measurement.uses
+        if full_size not in photos:
+            photos[full_size] = [load_photo(path, measurement.uses) for path in paths]
+        count = len(measurement.images)
+        differences = []
+        for start in range(0, len(paths) - count + 1, count):
+            images = photos[full_size][start:start + count]
+            try:
+                expected, actual = reference.measure(name, *images), candidate.measure(name, *images)
+            except ValueError:
+                continue
+            differences.extend(np.abs(np.subtract(expected, actual)).ravel().tolist())
+        drift[name] = {
+            "mean": float(np.mean(differences)) if differences else None,
+            "max": float(max(differences)) if differences else None,
+            "samples": len(differences),
+        }
+    return drift
+
+#Drift report of a quantized profile against the float models: keypoint error and latency per model, and the change
+#in every BASMI measurement
+def drift(folder, onnx_dir, profile, threads):
+    paths = image_paths(folder)
+    if not paths:
+        raise SystemExit(f"No images in {folder}")
+    reference = PoseEstimator(lazy=True, backend='onnx', onnx_dir=onnx_dir, onnx_threads=threads)
+    candidate = PoseEstimator(
+        lazy=True, backend='onnx', onnx_dir=onnx_dir, onnx_threads=threads, onnx_profile=profile)
+    report = compare(reference, candidate, paths)
+    report["measurements"] = measurement_drift(reference, candidate, paths)
+    report["images"] = len(paths)
+    report["profile"] = profile
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
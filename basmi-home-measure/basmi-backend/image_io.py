@@ -0,0 +1,65 @@
+import base64
+import os
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+#Decoded pixels that remember the size of the upload they were reduced from, so pixel-space geometry can still be
+#expressed in the original image's coordinates
+class ScaledImage(np.ndarray):
+    def __array_finalize__(self, obj):
+        self.original_shape = getattr(obj, 'original_shape', None)
+
+#Opens the image at a reduced scale when it is larger than the models need, input: open PIL image, longest side
+#wanted (None keeps full size), output: RGB pixels, a ScaledImage when reduced
+def _decode(image, max_side):
+    original_shape = (image.height, image.width)
+    if max_side and max(image.size) > max_side:
+        #JPEG: decode straight to 1/2, 1/4 or 1/8 scale in the DCT, never below the requested size
+        image.draft('RGB', (max_side * image.width // max(image.size), max_side * image.height // max(image.size)))
+        #Other formats (and JPEGs too large for 1/8) are reduced by whole-pixel binning after a full decode
+        factor = max(image.size) // max_side
+        if factor > 1:
+            image = image.reduce(factor)
+    pixels = np.asarray(image.convert('RGB'))
+    if pixels.shape[:2] == original_shape:
+        return pixels
+    pixels = pixels.view(ScaledImage)
+    pixels.original_shape = original_shape
+    return pixels
+
+#Decodes an uploaded image once into RGB pixels, input: encoded image bytes (JPEG/PNG), longest side to reduce to,
+#output: HxWx3 uint8 array
+def decode_image(image_bytes, max_side=None):
+    with Image.open(BytesIO(image_bytes)) as image:
+        return _decode(image, max_side)
+
+#Decodes the base64 image string sent by the app, input: base64 string, output: HxWx3 uint8 array
+def decode_base64_image(image_data, max_side=None):
+    return decode_image(base64.b64decode(image_data), max_side)
+
+#Normalises any accepted image input into RGB pixels, input: RGB array, encoded bytes or file path, output: HxWx3 uint8 array
+def load_image(source, max_side=None):
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source, max_side)
+    if isinstance(source, (str, os.PathLike)):
+        with Image.open(source) as image:
+            return _decode(image, max_side)
+    raise TypeError(f"Unsupported image input: {type(source).__name__}")
+
+#Height and width of the image as uploaded, before any reduction at decode time
+def original_shape(pixels):
+    return getattr(pixels, 'original_shape', None) or pixels.shape[:2]
+
+#Maps 2D keypoints found on reduced pixels back to the original image's pixel coordinates, input: pixels the
+#keypoints were found on, list of [x, y, ...] keypoints, output: keypoints in original coordinates
+def to_original_coordinates(pixels, keypoints):
+    height, width = original_shape(pixels)
+    if (height, width) == pixels.shape[:2]:
+        return keypoints
+    scale_x = width / pixels.shape[1]
+    scale_y = height / pixels.shape[0]
+    return [[x * scale_x, y * scale_y, *rest] for x, y, *rest in keypoints]
@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+#Raised when every worker is busy and the waiting queue is full
+class QueueFullError(Exception):
+    pass
+
+#Runs blocking PoseEstimator calls on a bounded pool of worker threads, keeping the event loop free, name labels
+#the pool's threads and metrics
+class InferenceExecutor:
+    def __init__(self, workers, queue_size, name='inference'):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.name = name
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+        #Counters shared between the event loop and the worker threads
+        self.lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    #Runs function(*args) on a worker thread, rejecting straight away when the queue is full
+    async def run(self, function, *args):
+        with self.lock:
+            if self.queued + self.running >= self.workers + self.queue_size:
+                self.rejected += 1
+                metrics.INFERENCE_REJECTED.inc(self.name)
+                raise QueueFullError(f"{self.queued} requests already waiting for {self.name} inference")
+            self.queued += 1
+
+        submitted = time.perf_counter()
+        #The job runs in a copy of the request's context, so metrics recorded on the worker keep the endpoint label
+        context = contextvars.copy_context()
+
+        def job():
+            wait = time.perf_counter() - submitted
+            with self.lock:
+                self.queued -= 1
+                self.running += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            metrics.INFERENCE_WAIT_SECONDS.observe(wait, self.name)
+            succeeded = False
+            try:
+                result = function(*args)
+                succeeded = True
+                return result
+            finally:
+                with self.lock:
+                    self.running -= 1
+                    if succeeded:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+        return await asyncio.wrap_future(self.executor.submit(context.run, job))
+
+    #Snapshot of queue depth and wait times for monitoring
+    def stats(self):
+        with self.lock:
+            started = self.completed + self.failed + self.running
+            return {
+                "workers": self.workers,
+                "queue_size": self.queue_size,
+                "queue_depth": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "mean_wait_seconds": self.total_wait / started if started else 0.0,
+                "max_wait_seconds": self.max_wait,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
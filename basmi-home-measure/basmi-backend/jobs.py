@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+from inference_executor import QueueFullError
+
+logger = logging.getLogger(__name__)
+
+#States a job moves through, the last two are final
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'error'
+FINISHED = (DONE, FAILED)
+
+#A measurement submitted through the job API, polled or streamed by the client using its id
+class Job:
+    def __init__(self, name, work):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        #Coroutine function producing the result, dropped once it has run so the uploaded images can be freed
+        self.work = work
+        self.state = QUEUED
+        self.result = None
+        self.message = None
+        self.created = time.time()
+        self.finished = None
+        #Set and replaced on every state change, so each listener wakes once per change
+        self.changed = asyncio.Event()
+
+    def set_state(self, state):
+        self.state = state
+        if state in FINISHED:
+            self.finished = time.time()
+            self.work = None
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+    def to_dict(self):
+        job = {"id": self.id, "name": self.name, "state": self.state, "created": self.created}
+        if self.state == DONE:
+            job["finished"] = self.finished
+            job["result"] = self.result
+        elif self.state == FAILED:
+            job["finished"] = self.finished
+            job["message"] = self.message
+        return job
+
+#Runs submitted jobs on a fixed number of runner tasks and keeps finished jobs for a bounded time, so the
+#client's connection only has to last for the submit and the poll, not for the inference
+class JobManager:
+    def __init__(self, runners, queue_size, retention_seconds, max_retained, retry_seconds):
+        self.runners = runners
+        self.queue_size = queue_size
+        self.retention_seconds = retention_seconds
+        self.max_retained = max_retained
+        self.retry_seconds = retry_seconds
+        self.queue = asyncio.Queue()
+        self.jobs = OrderedDict()
+        self.tasks = []
+
+    #Starts the runner tasks, must be called on the event loop
+    def start(self):
+        loop = asyncio.get_running_loop()
+        self.tasks = [loop.create_task(self._run()) for _ in range(self.runners)]
+
+    #Queues work() and returns its Job straight away, rejecting when too many jobs are already waiting
+    def submit(self, name, work):
+        self.prune()
+        if self.queue.qsize() >= self.queue_size:
+            raise QueueFullError(f"{self.queue.qsize()} jobs already waiting to run")
+        job = Job(name, work)
+        self.jobs[job.id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def get(self, job_id):
+        self.prune()
+        return self.jobs.get(job_id)
+
+    #Forgets finished jobs past their retention time, and the oldest finished ones beyond max_retained
+    def prune(self):
+        expiry = time.time() - self.retention_seconds
+        finished = [job for job in self.jobs.values() if job.state in FINISHED]
+        excess = len(finished) - self.max_retained
+        for job in finished:
+            if excess > 0 or job.finished < expiry:
+                del self.jobs[job.id]
+                excess -= 1
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            job.set_state(RUNNING)
+            #Stage metrics recorded while the job runs are labelled with the job's measurement
+            metrics.ENDPOINT.set(f'/jobs/{job.name}')
+            try:
+                while True:
+                    try:
+                        job.result = await job.work()
+                        break
+                    #Synchronous requests filled the inference queue, wait for room rather than failing the job
+                    except QueueFullError:
+                        await asyncio.sleep(self.retry_seconds)
+                job.set_state(DONE)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception("Job %s (%s) failed", job.id, job.name)
+                job.message = str(exc) or type(exc).__name__
+                job.set_state(FAILED)
+
+    #Number of retained jobs in each state
+    def stats(self):
+        counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED}
+        for job in self.jobs.values():
+            counts[job.state] += 1
+        return counts
+
+    def shutdown(self):
+        for task in self.tasks:
+            task.cancel()
@@ -0,0 +1,106 @@
+import numpy as np
+
+#MediaPipe pose landmark indices used by the measurements
+NOSE = 0
+LEFT_SHOULDER = 11
+RIGHT_SHOULDER = 12
+LEFT_WRIST = 15
+RIGHT_WRIST = 16
+LEFT_PINKY = 17
+RIGHT_PINKY = 18
+LEFT_INDEX = 19
+RIGHT_INDEX = 20
+LEFT_THUMB = 21
+RIGHT_THUMB = 22
+LEFT_HIP = 23
+RIGHT_HIP = 24
+LEFT_KNEE = 25
+RIGHT_KNEE = 26
+LEFT_ANKLE = 27
+RIGHT_ANKLE = 28
+LEFT_HEEL = 29
+RIGHT_HEEL = 30
+LEFT_FOOT_INDEX = 31
+RIGHT_FOOT_INDEX = 32
+POSE_LANDMARKS = 33
+
+#COCO-WholeBody keypoints (wholebody) and Human3.6M joints (human3d) used by the measurements
+WHOLEBODY_RIGHT_KNEE = 14
+WHOLEBODY_RIGHT_ANKLE = 16
+WHOLEBODY_LEFT_SMALL_TOE = 18
+WHOLEBODY_RIGHT_SMALL_TOE = 21
+WHOLEBODY_LEFT_RING_BASE = 104
+WHOLEBODY_RIGHT_RING_BASE = 125
+WHOLEBODY_KEYPOINTS = 133
+H36M_THORAX = 8
+H36M_HEAD = 10
+H36M_JOINTS = 17
+
+#Columns of a landmark row
+X, Y, Z, VISIBILITY, PRESENCE = range(5)
+COLUMNS = 5
+
+#Landmarks of one pose in one coordinate space (normalised image or world metres), one float32 row of x, y, z,
+#visibility and presence per landmark, no rows when no pose was found. Single points come back as Python floats
+#(float32 values are exact in a double), so the geometry computes exactly as it did on MediaPipe's own floats
+class Landmarks:
+    __slots__ = ('array',)
+
+    def __init__(self, array):
+        self.array = np.ascontiguousarray(array, dtype=np.float32).reshape(-1, COLUMNS)
+
+    #input: MediaPipe landmark list (NormalizedLandmark or Landmark), visibility/presence missing are stored as NaN
+    @classmethod
+    def from_mediapipe(cls, landmarks):
+        array = np.empty((len(landmarks), COLUMNS), dtype=np.float32)
+        for row, landmark in zip(array, landmarks):
+            row[:] = (
+                landmark.x, landmark.y, landmark.z,
+                np.nan if landmark.visibility is None else landmark.visibility,
+                np.nan if landmark.presence is None else landmark.presence,
+            )
+        return cls(array)
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, COLUMNS), dtype=np.float32))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getstate__(self):
+        return self.array
+
+    def __setstate__(self, array):
+        self.array = array
+
+    #[x, y, z] of one landmark
+    def point(self, index):
+        return self.array[index, :3].tolist()
+
+    #One column of one landmark, e.g. value(LEFT_PINKY, Y)
+    def value(self, index, column):
+        return float(self.array[index, column])
+
+    #(K, 3) view of every landmark's x, y, z
+    @property
+    def xyz(self):
+        return self.array[:, :3]
+
+    @property
+    def visibility(self):
+        return self.array[:, VISIBILITY]
+
+    @property
+    def presence(self):
+        return self.array[:, PRESENCE]
+
+#Landmarks of the first pose of a MediaPipe PoseLandmarker result, output: (normalised image landmarks, world
+#landmarks in metres with the origin between the hips), both empty when no pose was found
+def pose_landmarks(detection_result):
+    if not detection_result.pose_landmarks or not detection_result.pose_world_landmarks:
+        return Landmarks.empty(), Landmarks.empty()
+    return (
+        Landmarks.from_mediapipe(detection_result.pose_landmarks[0]),
+        Landmarks.from_mediapipe(detection_result.pose_world_landmarks[0]),
+    )
@@ -0,0 +1,62 @@
+import threading
+
+from image_io import original_shape
+from measurement_registry import evaluate
+
+#Measurements that can be followed live, endpoint name -> registered measurement (two images, neutral then moved)
+LIVE_MEASUREMENTS = {
+    "cervicalleft": "cervical_rotation_left",
+    "cright": "cervical_rotation_right",
+    "flexionleft": "side_flexion_left",
+    "rights": "side_flexion_right",
+}
+
+#Follows one movement through a stream of camera frames with a tracking MediaPipe landmarker, keeping the peak.
+#The first frame with a pose is the neutral position, every later frame is measured against it like the second
+#photo of the still measurement, and the largest value is the result
+class LiveMeasurement:
+    def __init__(self, estimator, name):
+        self.estimator = estimator
+        self.measurement = LIVE_MEASUREMENTS[name]
+        self.landmarker = estimator.create_video_landmarker()
+        #Frames of one stream are tracked one at a time, closing waits for the frame in progress
+        self.lock = threading.Lock()
+        self.last_timestamp = -1
+        #MediaPipe output of the neutral frame
+        self.baseline = None
+        self.peak = None
+        self.frames = 0
+        self.measured = 0
+
+    #Measures the next frame of the stream, input: RGB pixels, capture time in ms, output: the frame's value, or None
+    #when no pose was found
+    def process(self, pixels, timestamp_ms):
+        with self.lock:
+            #The landmarker rejects timestamps that do not increase
+            timestamp_ms = max(int(timestamp_ms), self.last_timestamp + 1)
+            self.last_timestamp = timestamp_ms
+            landmarks_data, world_landmarks_data = self.estimator.run_media_pipe_video(
+                self.landmarker, pixels, timestamp_ms)
+        self.frames += 1
+        if not world_landmarks_data:
+            return None
+
+        current = {"shape": original_shape(pixels), "mediapipe": (landmarks_data, world_landmarks_data)}
+        if self.baseline is None:
+            self.baseline = current
+            value = 0.0
+        else:
+            try:
+                value = evaluate({self.measurement: [0, 1]}, [self.baseline, current])[self.measurement]
+            #Degenerate poses (nose on the shoulder midpoint, shoulder on the toe) are skipped like frames without a
+            #pose
+            except ValueError:
+                return None
+
+        self.measured += 1
+        self.peak = value if self.peak is None else max(self.peak, value)
+        return value
+
+    def close(self):
+        with self.lock:
+            self.landmarker.close()
@@ -1,16 +1,37 @@
+import asyncio
+import functools
+import json
+import logging
+import threading
+import time
+
 import uvicorn
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-import base64
-import os
-import tempfile
-from io import BytesIO
-from PIL import Image
-
-from pose_estimator import PoseEstimator
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+import config
+import metrics
+from image_io import decode_base64_image, decode_image
+from inference_executor import QueueFullError
+from jobs import FINISHED, JobManager
+from live_measurement import LIVE_MEASUREMENTS, LiveMeasurement
+from measurement_registry import plan_models
+from measurement_store import MeasurementStore
+from model_router import ModelRouter, measurement_pool
+from pose_estimator import MODEL_ORDER, PoseEstimator
+from upload import UploadFormatError, UploadTooLargeError, extract_images, extract_video, read_body
+from video_measurement import VIDEO_SIGNALS, measure_video
+
+#JSON responses record how long serialising the result takes
+class TimedJSONResponse(JSONResponse):
+    def render(self, content):
+        with metrics.stage('serialization'):
+            return super().render(content)
 
 #FastAPI instance
-app = FastAPI()
+app = FastAPI(default_response_class=TimedJSONResponse)
 
 # Allow frontend to connect
 app.add_middleware(
@@ -21,8 +42,286 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-#Instance of PoseEstimator class
-pose = PoseEstimator()
+logger = logging.getLogger(__name__)
+
+#Instance of PoseEstimator class, models are loaded by prepare_estimator (eager/background) or on first use (lazy)
+estimator = PoseEstimator(
+    config.BATCH_MAX_SIZE, config.BATCH_WINDOW_MS / 1000, config.CACHE_BYTES, lazy=True,
+    backend=config.POSE_BACKEND, onnx_dir=config.ONNX_MODEL_DIR, onnx_threads=config.ONNX_THREADS,
+    onnx_profile=config.ONNX_PROFILE, roi_crop=config.ROI_CROP, roi_margin=config.ROI_MARGIN,
+    profile=config.INFERENCE_PROFILE, cascade=config.CASCADE, cascade_threshold=config.CASCADE_THRESHOLD)
+#One bounded worker pool per model, the endpoints run on the pool of the slowest model they need and measure with
+#the estimator itself, or with worker processes forked for that pool in pool mode
+router = ModelRouter(estimator, config.MODEL_POOLS)
+
+#Readiness reported by /readyz, lazy mode is ready straight away and loads each model on first use
+readiness = {"ready": config.STARTUP_MODE == 'lazy', "error": None}
+
+#Loads the models, runs the warm-up inferences and in pool mode forks the workers from the warm parent, each warming
+#up the models it rebuilds before the server reports ready
+def prepare_estimator():
+    try:
+        estimator.load()
+        if config.WARM_UP:
+            estimator.warm_up()
+        if config.POOL_PROCESSES:
+            router.fork(estimator, config.THREADS_PER_PROCESS, config.WARM_UP)
+        readiness["ready"] = True
+    except Exception as exc:
+        readiness["error"] = repr(exc)
+        logger.exception("Loading the pose models failed")
+        raise
+
+#Eager mode keeps the original behaviour: everything is loaded before uvicorn binds
+if config.STARTUP_MODE == 'eager':
+    prepare_estimator()
+
+#Inference never runs on the event loop, each model pool reports its own queue
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    'basmi_inference_queue_depth', 'Requests waiting for a worker of a model pool', ('pool',),
+    lambda: {(pool,): stats["queue_depth"] for pool, stats in router.stats().items()}))
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    'basmi_inference_running', 'Requests currently running on a worker of a model pool', ('pool',),
+    lambda: {(pool,): stats["running"] for pool, stats in router.stats().items()}))
+
+#Jobs submitted through /jobs, run on the same model pools and kept for a bounded time once finished
+job_manager = JobManager(
+    router.workers(), config.JOB_QUEUE_SIZE, config.JOB_RETENTION_SECONDS, config.JOB_MAX_RETAINED,
+    config.RETRY_AFTER_SECONDS)
+metrics.REGISTRY.register(metrics.CallbackGauge(
+    'basmi_jobs', 'Retained jobs by state', ('state',),
+    lambda: {(state,): count for state, count in job_manager.stats().items()}))
+#Seconds between keep-alive comments on an idle job event stream, stops proxies closing it
+JOB_KEEPALIVE_SECONDS = 15
+
+#History of results sent with an X-Patient-Id header, written in groups off the request path
+store = None
+if config.STORE_PATH:
+    store = MeasurementStore(config.STORE_PATH, config.STORE_BATCH_SIZE, config.STORE_FLUSH_MS / 1000)
+
+#Longest side each image of a plan ({method: image indices}) is reduced to while decoding. human3d's lifter
+#normalises its 2D keypoints by the image width and scales the lifted pose back by it, so a reduced image changes the
+#tragus result, images human3d runs on are decoded at full size
+def decode_sides(plan, count):
+    return [
+        None if "human3d" in models else config.DECODE_MAX_SIDE
+        for models in plan_models(plan, count)
+    ]
+
+#Decodes the uploaded images at their sides from decode_sides and runs the measurement, called on an inference worker
+#thread
+def decode_and_measure(measurement, sides, *images_data):
+    with metrics.stage('decode'):
+        images = [decode_base64_image(image_data, side) for image_data, side in zip(images_data, sides)]
+    return measurement(*images)
+
+#Decodes raw uploaded image bytes and runs the measurement, called on an inference worker thread
+def decode_uploads_and_measure(measurement, sides, *images_bytes):
+    with metrics.stage('decode'):
+        images = [decode_image(image_bytes, side) for image_bytes, side in zip(images_bytes, sides)]
+    return measurement(*images)
+
+#Decodes one frame of a live stream (binary JPEG or base64 text) and tracks it, called on an inference worker thread
+def decode_and_track(live, frame, timestamp_ms):
+    with metrics.stage('decode'):
+        if isinstance(frame, bytes):
+            pixels = decode_image(frame, config.DECODE_MAX_SIDE)
+        else:
+            pixels = decode_base64_image(frame, config.DECODE_MAX_SIDE)
+    return live.process(pixels, timestamp_ms)
+
+#Measurement endpoint name -> (PoseEstimator method, image fields in the order the method takes them)
+MEASUREMENTS = {
+    "tragusleft": ("tragus_to_wall_left", ("image",)),
+    "tragusright": ("tragus_to_wall_right", ("image",)),
+    "flexionleft": ("side_flexion_left", ("image1", "image2")),
+    "rights": ("side_flexion_right", ("image1", "image2")),
+    "lumbar": ("lumbar_flexion", ("image1", "image2")),
+    "cervicalleft": ("cervical_rotation_left", ("image1", "image2")),
+    "cright": ("cervical_rotation_right", ("image1", "image2")),
+    "intermalleolar": ("intermalleolar_distance", ("image",)),
+}
+
+#Decodes each distinct upload of a session once and runs all its measurements with session (measure_session or
+#measure_session_with_summary), called on an inference worker thread
+def decode_session_and_measure(session, measurements, *images_data):
+    sides = decode_sides(measurements, len(images_data))
+    with metrics.stage('decode'):
+        images = [decode_base64_image(image_data, side) for image_data, side in zip(images_data, sides)]
+    return session(measurements, *images)
+
+#Patient/device key a request's results are stored under, None when the client did not send one
+def patient_id(request):
+    return request.headers.get('x-patient-id') or None
+
+#Runs a measurement on the inference workers with decode (decode_and_measure or decode_uploads_and_measure). When
+#a patient is given the landmarks used are summarised too and the result is queued for the measurement store,
+#output: the measurement's result
+async def measure(patient, method, decode, *images):
+    pool = measurement_pool(method)
+    pose = router.pose(pool)
+    sides = decode_sides({method: list(range(len(images)))}, len(images))
+    if store is None or patient is None:
+        return await router.run(pool, decode, functools.partial(pose.measure, method), sides, *images)
+
+    result, summary = await router.run(
+        pool, decode, functools.partial(pose.measure_with_summary, method), sides, *images)
+    store.record(patient, method, result, estimator.model_versions(method), summary)
+    return result
+
+#Builds a session's work from its request body, output: (distinct base64 images, {method: image indices})
+#raises ValueError with the message for the client when the body is incomplete or malformed
+def plan_session(body):
+    if not isinstance(body, dict):
+        raise ValueError("Expected a JSON object with images and measurements")
+    images = body.get('images') or {}
+    requested = body.get('measurements') or {}
+
+    if not images or not requested:
+        raise ValueError("No image data received")
+    if not isinstance(images, dict) or not isinstance(requested, dict):
+        raise ValueError("images and measurements must be JSON objects")
+    if not all(isinstance(image_data, str) for image_data in images.values()):
+        raise ValueError("Each image must be a base64 string")
+
+    # Identical uploads under different keys share one index
+    images_data = []
+    data_index = {}
+    key_index = {}
+    for key, image_data in images.items():
+        if not image_data:
+            continue
+        if image_data not in data_index:
+            data_index[image_data] = len(images_data)
+            images_data.append(image_data)
+        key_index[key] = data_index[image_data]
+
+    # Measurement name -> indices of its images, in the order the PoseEstimator method takes them
+    plan = {}
+    for name, fields in requested.items():
+        if name not in MEASUREMENTS:
+            raise ValueError(f"Unknown measurement: {name}")
+        method, image_fields = MEASUREMENTS[name]
+        if fields is not None and not isinstance(fields, dict):
+            raise ValueError(f"Image fields of {name} must be a JSON object")
+        keys = [(fields or {}).get(field) for field in image_fields]
+        if any(not isinstance(key, str) or key not in key_index for key in keys):
+            raise ValueError(f"No image data received for {name}")
+        plan[method] = [key_index[key] for key in keys]
+
+    return images_data, plan
+
+#Runs a planned session on the inference workers, storing each result when a patient is given,
+#output: {measurement name: result}
+async def run_session(requested, images_data, plan, patient=None):
+    pool = router.session_pool(plan)
+    pose = router.pose(pool)
+    if store is None or patient is None:
+        results = await router.run(pool, decode_session_and_measure, pose.measure_session, plan, *images_data)
+        return {name: results[MEASUREMENTS[name][0]] for name in requested}
+
+    summarised = await router.run(
+        pool, decode_session_and_measure, pose.measure_session_with_summary, plan, *images_data)
+    for method, (result, summary) in summarised.items():
+        store.record(patient, method, result, estimator.model_versions(method), summary)
+    return {name: summarised[MEASUREMENTS[name][0]][0] for name in requested}
+
+#Metric label for a request path, unknown paths share one label to keep the number of series bounded
+def endpoint_label(path):
+    for prefix in ('/upload/', '/video/'):
+        if path.startswith(prefix) and path[len(prefix):] in MEASUREMENTS:
+            return path
+    if path.startswith('/jobs/'):
+        return '/jobs'
+    if any(getattr(route, 'path', None) == path for route in app.routes):
+        return path
+    return 'other'
+
+#Labels the request with its endpoint for the stage metrics, and records status counts and total latency
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    endpoint = endpoint_label(request.url.path)
+    token = metrics.ENDPOINT.set(endpoint)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.ENDPOINT.reset(token)
+        metrics.REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint)
+        metrics.REQUESTS.inc(endpoint, str(status))
+        if status >= 400:
+            metrics.ERRORS.inc(endpoint)
+
+#Busy server: reject quickly so the client can retry rather than queueing without bound
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: QueueFullError):
+    return JSONResponse(
+        status_code=503,
+        content={"status": "error", "message": "Server busy, please retry"},
+        headers={"Retry-After": str(config.RETRY_AFTER_SECONDS)},
+    )
+
+@app.exception_handler(UploadTooLargeError)
+async def upload_too_large_handler(request: Request, exc: UploadTooLargeError):
+    return JSONResponse(status_code=413, content={"status": "error", "message": str(exc)})
+
+@app.exception_handler(UploadFormatError)
+async def upload_format_handler(request: Request, exc: UploadFormatError):
+    return JSONResponse(status_code=400, content={"status": "error", "message": str(exc)})
+
+#Background mode binds straight away and loads the models on a separate thread
+@app.on_event("startup")
+def start_background_load():
+    if config.STARTUP_MODE == 'background':
+        threading.Thread(target=prepare_estimator, name='model-loader', daemon=True).start()
+
+#Job runners are tasks on the server's event loop
+@app.on_event("startup")
+async def start_job_runners():
+    job_manager.start()
+
+@app.on_event("shutdown")
+def shutdown_executor():
+    job_manager.shutdown()
+    router.shutdown()
+    if store is not None:
+        store.close()
+
+#Liveness probe: the process is up and serving HTTP
+@app.get("/livez")
+async def livez():
+    return {"status": "alive"}
+
+#Readiness probe: only route traffic here once the models are loaded and warm
+@app.get("/readyz")
+async def readyz():
+    if readiness["ready"]:
+        return {"status": "ready"}
+    if readiness["error"]:
+        return JSONResponse(status_code=503, content={"status": "error", "message": readiness["error"]})
+    return JSONResponse(status_code=503, content={"status": "loading"})
+
+#Prometheus scrape endpoint: per-endpoint stage histograms, request/error/cache counters and queue gauges
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.REGISTRY.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+#Queue depth and wait time of each model pool's workers, plus wholebody batch sizes and cache hit rates when running in
+#this process (each pool worker process keeps its own)
+@app.get("/stats")
+async def stats():
+    response = {"status": "success", "inference": router.stats(), "jobs": job_manager.stats()}
+    #Inference profile and model identities (landmarker, backend, precision profile) the results are computed with
+    response["profile"] = estimator.profile
+    response["models"] = {model: estimator.model_identity(model) for model in MODEL_ORDER}
+    if not router.forked and estimator.wholebody_batcher:
+        response["batching"] = {"wholebody": estimator.wholebody_batcher.stats()}
+    if not router.forked and estimator.cache:
+        response["cache"] = estimator.cache.stats()
+    return response
 
 #Each app.post relates to a different measurement accessed by the measuring page
 
@@ -35,16 +334,8 @@ async def tragus_to_wall_left(request: Request):
     if not image_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_bytes = base64.b64decode(image_data)
-    image = Image.open(BytesIO(image_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-        tmp_path = tmp.name
-        image.save(tmp_path, format='JPEG')
-
-    result = pose.tragus_to_wall_left(tmp_path)
-    os.remove(tmp_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "tragus_to_wall_left", decode_and_measure, image_data)
 
     return {"status": "success", "result": result}
 
@@ -57,17 +348,8 @@ async def tragus_to_wall_right(request: Request):
     if not image_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_bytes = base64.b64decode(image_data)
-    image = Image.open(BytesIO(image_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-        tmp_path = tmp.name
-        image.save(tmp_path, format='JPEG')
-
-    result = pose.tragus_to_wall_right(tmp_path)
-
-    os.remove(tmp_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "tragus_to_wall_right", decode_and_measure, image_data)
 
     return {"status": "success", "result": result}
 
@@ -81,24 +363,8 @@ async def side_flexion_left(request: Request):
     if not image_one_data or not image_two_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_one_bytes = base64.b64decode(image_one_data)
-    image_two_bytes = base64.b64decode(image_two_data)
-    image_one = Image.open(BytesIO(image_one_bytes))
-    image_two = Image.open(BytesIO(image_two_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp1:
-        tmp1_path = tmp1.name
-        image_one.save(tmp1_path, format='JPEG')
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp2:
-        tmp2_path = tmp2.name
-        image_two.save(tmp2_path, format='JPEG')
-
-    result = pose.side_flexion_left(tmp1_path, tmp2_path)
-
-    os.remove(tmp1_path)
-    os.remove(tmp2_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "side_flexion_left", decode_and_measure, image_one_data, image_two_data)
 
     return {"status": "success", "result": result}
 
@@ -113,24 +379,8 @@ async def side_flexion_right(request: Request):
     if not image_one_data or not image_two_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_one_bytes = base64.b64decode(image_one_data)
-    image_two_bytes = base64.b64decode(image_two_data)
-    image_one = Image.open(BytesIO(image_one_bytes))
-    image_two = Image.open(BytesIO(image_two_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp1:
-        tmp1_path = tmp1.name
-        image_one.save(tmp1_path, format='JPEG')
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp2:
-        tmp2_path = tmp2.name
-        image_two.save(tmp2_path, format='JPEG')
-
-    result = pose.side_flexion_right(tmp1_path, tmp2_path)
-
-    os.remove(tmp1_path)
-    os.remove(tmp2_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "side_flexion_right", decode_and_measure, image_one_data, image_two_data)
 
     return {"status": "success", "result": result}
 
@@ -144,24 +394,8 @@ async def lumbar_flexion(request: Request):
     if not image_one_data or not image_two_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_one_bytes = base64.b64decode(image_one_data)
-    image_two_bytes = base64.b64decode(image_two_data)
-    image_one = Image.open(BytesIO(image_one_bytes))
-    image_two = Image.open(BytesIO(image_two_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp1:
-        tmp1_path = tmp1.name
-        image_one.save(tmp1_path, format='JPEG')
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp2:
-        tmp2_path = tmp2.name
-        image_two.save(tmp2_path, format='JPEG')
-
-    result = pose.lumbar_flexion(tmp1_path, tmp2_path)
-
-    os.remove(tmp1_path)
-    os.remove(tmp2_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "lumbar_flexion", decode_and_measure, image_one_data, image_two_data)
 
     return {"status": "success", "result": result}
 
@@ -175,24 +409,8 @@ async def cervical_rotation_left(request: Request):
     if not image_one_data or not image_two_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_one_bytes = base64.b64decode(image_one_data)
-    image_two_bytes = base64.b64decode(image_two_data)
-    image_one = Image.open(BytesIO(image_one_bytes))
-    image_two = Image.open(BytesIO(image_two_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp1:
-        tmp1_path = tmp1.name
-        image_one.save(tmp1_path, format='JPEG')
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp2:
-        tmp2_path = tmp2.name
-        image_two.save(tmp2_path, format='JPEG')
-
-    result = pose.cervical_rotation_left(tmp1_path, tmp2_path)
-
-    os.remove(tmp1_path)
-    os.remove(tmp2_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "cervical_rotation_left", decode_and_measure, image_one_data, image_two_data)
 
     return {"status": "success", "result": result}
 
@@ -206,24 +424,8 @@ async def cervical_rotation_right(request: Request):
     if not image_one_data or not image_two_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_one_bytes = base64.b64decode(image_one_data)
-    image_two_bytes = base64.b64decode(image_two_data)
-    image_one = Image.open(BytesIO(image_one_bytes))
-    image_two = Image.open(BytesIO(image_two_bytes))
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp1:
-        tmp1_path = tmp1.name
-        image_one.save(tmp1_path, format='JPEG')
-
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp2:
-        tmp2_path = tmp2.name
-        image_two.save(tmp2_path, format='JPEG')
-
-    result = pose.cervical_rotation_right(tmp1_path, tmp2_path)
-
-    os.remove(tmp1_path)
-    os.remove(tmp2_path)
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "cervical_rotation_right", decode_and_measure, image_one_data, image_two_data)
 
     return {"status": "success", "result": result}
 
@@ -237,20 +439,223 @@ async def intermalleolar_distance(request: Request):
     if not image_data:
         return {"status": "error", "message": "No image data received"}
 
-    # Decode base64 -> bytes -> Pillow image
-    image_bytes = base64.b64decode(image_data)
-    image = Image.open(BytesIO(image_bytes))
+    # Decode base64 -> RGB pixels and measure on a worker thread
+    result = await measure(patient_id(request), "intermalleolar_distance", decode_and_measure, image_data)
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-        tmp_path = tmp.name
-        image.save(tmp_path, format='JPEG')
+    return {"status": "success", "result": result}
+
+#All measurements of a visit in one request: {"images": {key: base64}, "measurements": {name: {field: key}}},
+#e.g. {"lumbar": {"image1": "standing", "image2": "bent"}}, with names and fields matching the endpoints above.
+#Each distinct image is decoded once and each (image, model) inference runs once however many measurements use it
+@app.post("/session")
+async def measurement_session(request: Request):
+    body = await request.json()
+    try:
+        images_data, plan = plan_session(body)
+    except ValueError as exc:
+        return {"status": "error", "message": str(exc)}
+
+    result = await run_session(body['measurements'], images_data, plan, patient_id(request))
 
-    result = pose.intermalleolar_distance(tmp_path)
+    return {"status": "success", "result": result, "images": len(images_data)}
 
-    os.remove(tmp_path)
+#Binary versions of the endpoints above, e.g. /upload/lumbar: takes a raw image/* body for single image
+#measurements or multipart/form-data with the same field names as the JSON API, no base64 involved
+@app.post("/upload/{name}")
+async def upload_measurement(name: str, request: Request):
+    if name not in MEASUREMENTS:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown measurement: {name}"})
+    method, image_fields = MEASUREMENTS[name]
+
+    # Stream the body into one bounded buffer, the images are views into it
+    body = await read_body(request, config.MAX_UPLOAD_BYTES)
+    images = extract_images(request.headers.get('content-type', ''), body, image_fields)
+
+    result = await measure(patient_id(request), method, decode_uploads_and_measure, *images)
 
     return {"status": "success", "result": result}
 
+#Stored results of one patient in time order, for trend charts: optional measurement (endpoint or method name),
+#since/until (epoch seconds) and limit (1 to 10000 rows) query parameters. A plain def so FastAPI runs the query on
+#its thread pool
+@app.get("/history/{patient}")
+def measurement_history(patient: str, measurement: str = None, since: float = None, until: float = None, limit: int = 1000):
+    if store is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Measurement store is disabled"})
+    if measurement in MEASUREMENTS:
+        measurement = MEASUREMENTS[measurement][0]
+    return {"status": "success", "history": store.history(patient, measurement, since, until, max(1, min(limit, 10000)))}
+
+#Job versions of the JSON endpoints for slow connections, e.g. /jobs/lumbar or /jobs/session: takes the same body,
+#answers 202 with the job id straight away, and the result is fetched from /jobs/{id} or streamed from
+#/jobs/{id}/events once the measurement has run
+@app.post("/jobs/{name}")
+async def submit_job(name: str, request: Request):
+    body = await request.json()
+    patient = patient_id(request)
+
+    if name == 'session':
+        try:
+            images_data, plan = plan_session(body)
+        except ValueError as exc:
+            return {"status": "error", "message": str(exc)}
+        requested = body['measurements']
+        work = lambda: run_session(requested, images_data, plan, patient)
+    elif name in MEASUREMENTS:
+        method, image_fields = MEASUREMENTS[name]
+        images_data = [body.get(field) for field in image_fields]
+        if not all(images_data):
+            return {"status": "error", "message": "No image data received"}
+        # pose is looked up when the job runs, background loading may have swapped in the worker pool by then
+        work = lambda: measure(patient, method, decode_and_measure, *images_data)
+    else:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown measurement: {name}"})
+
+    job = job_manager.submit(name, work)
+    return JSONResponse(
+        status_code=202,
+        content={"status": "success", "job": job.to_dict()},
+        headers={"Location": f"/jobs/{job.id}"},
+    )
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown or expired job"})
+    return {"status": "success", "job": job.to_dict()}
+
+#Server-sent events: one event named after the job's state on connect and on every change, ending once it finishes
+@app.get("/jobs/{job_id}/events")
+async def stream_job(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"status": "error", "message": "Unknown or expired job"})
+
+    async def events():
+        while True:
+            changed = job.changed
+            yield f"event: {job.state}\ndata: {json.dumps(jsonable_encoder(job.to_dict()))}\n\n"
+            if job.state in FINISHED:
+                return
+            while not changed.is_set():
+                try:
+                    await asyncio.wait_for(changed.wait(), JOB_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={"Cache-Control": "no-cache"})
+
+#Video versions of the movement measurements, e.g. /video/lumbar: takes a short clip of the whole movement as a raw
+#video/* body or the "video" field of multipart/form-data. A quick low resolution pass finds the start and peak
+#frames and only those are measured, with the same models as the photo endpoints
+@app.post("/video/{name}")
+async def video_measurement(name: str, request: Request):
+    if name not in MEASUREMENTS or MEASUREMENTS[name][0] not in VIDEO_SIGNALS:
+        return JSONResponse(status_code=404, content={"status": "error", "message": f"Unknown movement measurement: {name}"})
+    method, image_fields = MEASUREMENTS[name]
+
+    body = await read_body(request, config.MAX_VIDEO_BYTES)
+    video = extract_video(request.headers.get('content-type', ''), body)
+
+    # The scan tracks frames with a landmarker in this process, the keyframes are measured by pose like any upload
+    pool = measurement_pool(method)
+    measured = await router.run(
+        pool, measure_video, estimator, getattr(router.pose(pool), method), method, len(image_fields), video,
+        config.VIDEO_SCAN_FPS, config.VIDEO_SCAN_SIDE, config.VIDEO_MAX_SECONDS, config.VIDEO_SEEK_FRAMES)
+    if measured is None:
+        return {"status": "error", "message": "No pose found in the video"}
+
+    result, keyframes = measured
+    return {"status": "success", "result": result, "keyframes": keyframes}
+
+#Live version of the cervical rotation and side flexion endpoints, e.g. /live/cervicalleft: the client streams camera
+#frames (JPEG as binary messages or base64 as text), starting in the neutral position and moving to the limit, and
+#sends the text message "end" to get the peak back. Each measured frame is answered with its value. Frames that
+#arrive while one is being measured replace each other, so a slow server skips to the newest frame instead of
+#falling behind
+@app.websocket("/live/{name}")
+async def live_measurement(websocket: WebSocket, name: str):
+    if name not in LIVE_MEASUREMENTS:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    endpoint = f'/live/{name}'
+    metrics.ENDPOINT.set(endpoint)
+
+    # The tracking landmarker is per stream and lives in this process, the estimator is already loaded in pool mode
+    try:
+        live = await router.run('mediapipe', LiveMeasurement, estimator, name)
+    except QueueFullError:
+        await websocket.close(code=1013, reason="Server busy, please retry")
+        return
+
+    start = time.perf_counter()
+    # Newest frame not yet measured and its arrival time in ms, replaced by any frame arriving after it
+    pending = None
+    frame_ready = asyncio.Event()
+    ended = False
+    dropped = 0
+
+    async def receive_frames():
+        nonlocal pending, ended, dropped
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                frame = message.get("bytes") if message.get("bytes") is not None else message.get("text")
+                if frame == "end":
+                    ended = True
+                    return
+                if frame:
+                    if pending is not None:
+                        dropped += 1
+                        metrics.LIVE_FRAMES.inc(endpoint, 'dropped')
+                    pending = (frame, (time.perf_counter() - start) * 1000)
+                    frame_ready.set()
+        finally:
+            frame_ready.set()
+
+    receiving = asyncio.get_running_loop().create_task(receive_frames())
+    try:
+        while True:
+            # Only wait when there is nothing left to measure, a frame may have arrived (and the stream ended) while
+            # the last one was being measured, after the event was cleared
+            if pending is None:
+                if receiving.done():
+                    break
+                await frame_ready.wait()
+                frame_ready.clear()
+                continue
+            (frame, timestamp_ms), pending = pending, None
+            try:
+                value = await router.run('mediapipe', decode_and_track, live, frame, timestamp_ms)
+            # A frame that does not decode (bad base64 is a ValueError, an unreadable image an OSError) is dropped like
+            # one the server had no time for, the stream goes on
+            except (QueueFullError, ValueError, OSError):
+                dropped += 1
+                metrics.LIVE_FRAMES.inc(endpoint, 'dropped')
+                continue
+            metrics.LIVE_FRAMES.inc(endpoint, 'processed')
+            await websocket.send_json({"status": "success", "value": value, "peak": live.peak, "dropped": dropped})
+
+        if ended:
+            if live.peak is None:
+                await websocket.send_json({"status": "error", "message": "No pose found in the stream"})
+            else:
+                await websocket.send_json({
+                    "status": "success",
+                    "result": live.peak,
+                    "frames": live.frames,
+                    "measured": live.measured,
+                    "dropped": dropped,
+                })
+            await websocket.close()
+    finally:
+        receiving.cancel()
+        live.close()
+
 #Entry point
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
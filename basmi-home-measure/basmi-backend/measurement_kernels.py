@@ -0,0 +1,108 @@
+import numpy as np
+
+from landmarks import (
+    H36M_HEAD, H36M_THORAX, LEFT_ANKLE, LEFT_FOOT_INDEX, LEFT_HEEL, LEFT_KNEE, LEFT_SHOULDER, NOSE, RIGHT_HEEL,
+    RIGHT_SHOULDER, WHOLEBODY_LEFT_RING_BASE, WHOLEBODY_LEFT_SMALL_TOE, WHOLEBODY_RIGHT_ANKLE, WHOLEBODY_RIGHT_KNEE,
+    WHOLEBODY_RIGHT_RING_BASE, WHOLEBODY_RIGHT_SMALL_TOE)
+
+#The BASMI measurements over N sessions at once, on stacked (N, K, 3) landmark arrays (float64, wholebody keypoints
+#may be (N, K, 2)). These are the only copies of the formulas: still photos, sessions, live streams, video scans and
+#the ONNX drift report all reach them through measurement_registry. The floating point operations follow the original
+#per-image formulas in the same order, so results match those stored before. A degenerate pose (shoulder on the toe,
+#nose on the shoulder midpoint) gives NaN or inf for that session, which evaluate reports as a ValueError
+
+#Python's round() over an array. NumPy rounds x * 10**digits to the nearest integer, and that product can land on a
+#half when x is just below one, so values next to a half are rounded again with round() itself
+def round_like_python(values, digits=1):
+    values = np.asarray(values, dtype=np.float64)
+    rounded = np.round(values, digits)
+    scaled = values * 10 ** digits
+    for index in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        rounded.flat[index] = round(float(values.flat[index]), digits)
+    return rounded
+
+#3D distance between matching rows of two (N, 3) arrays
+def euclidean_distance(points1, points2):
+    difference = points1 - points2
+    return np.sqrt(difference[:, 0] ** 2 + difference[:, 1] ** 2 + difference[:, 2] ** 2)
+
+#2D distance between matching rows of two (N, 2+) arrays
+def distance_between_points(points1, points2):
+    return np.sqrt((points1[:, 0] - points2[:, 0]) ** 2 + (points1[:, 1] - points2[:, 1]) ** 2)
+
+#Tragus to wall distance in cm from human3d keypoints
+def tragus(keypoints):
+    result = np.abs(keypoints[:, H36M_HEAD, 2] - keypoints[:, H36M_THORAX, 2])
+    return round_like_python(result * 100, 1)
+
+#Metres per pixel from the shoulder to toe distance, input: (N, 2) image heights and widths, normalised and world
+#MediaPipe landmarks
+def side_helper_calibration(shapes, landmarks, world_landmarks):
+    h, w = shapes[:, 0], shapes[:, 1]
+    shoulder_x = np.trunc(landmarks[:, LEFT_SHOULDER, 0] * w)
+    shoulder_y = np.trunc(landmarks[:, LEFT_SHOULDER, 1] * h)
+    toe_x = np.trunc(landmarks[:, LEFT_FOOT_INDEX, 0] * w)
+    toe_y = np.trunc(landmarks[:, LEFT_FOOT_INDEX, 1] * h)
+    #Whole pixel coordinates, the sum of squares is exact so this is math.dist's result
+    pixel_distance = np.sqrt((shoulder_x - toe_x) ** 2 + (shoulder_y - toe_y) ** 2)
+
+    world_distance = euclidean_distance(world_landmarks[:, LEFT_SHOULDER], world_landmarks[:, LEFT_FOOT_INDEX])
+
+    return world_distance / pixel_distance
+
+#Calibrated hand to foot distance in metres
+def finger_floor_distance(shapes, landmarks, world_landmarks, hand, foot):
+    h = shapes[:, 0]
+    h_y = np.trunc(landmarks[:, hand, 1] * h)
+    f_y = np.trunc(landmarks[:, foot, 1] * h)
+    pixel_distance = np.abs(h_y - f_y)
+    pixel_size = side_helper_calibration(shapes, landmarks, world_landmarks)
+
+    return pixel_distance * pixel_size
+
+#Side flexion in cm from the before and after images, the change in finger_floor_distance
+def side_flexion(before_shapes, before_landmarks, before_world_landmarks,
+                 after_shapes, after_landmarks, after_world_landmarks, hand, foot):
+    before = finger_floor_distance(before_shapes, before_landmarks, before_world_landmarks, hand, foot)
+    after = finger_floor_distance(after_shapes, after_landmarks, after_world_landmarks, hand, foot)
+    return np.abs(round_like_python((before - after) * 100, 1))
+
+#Shin length in cm from MediaPipe world landmarks
+def shin_length(world_landmarks):
+    return euclidean_distance(world_landmarks[:, LEFT_KNEE], world_landmarks[:, LEFT_ANKLE]) * 100
+
+#Lumbar flexion (left, right) in cm, output: (N, 2) array
+def lumbar_flexion(shin_lengths, before_keypoints, after_keypoints):
+    def hand_to_foot(keypoints):
+        ratio = distance_between_points(
+            keypoints[:, WHOLEBODY_RIGHT_KNEE], keypoints[:, WHOLEBODY_RIGHT_ANKLE]) / shin_lengths
+        left = keypoints[:, WHOLEBODY_LEFT_SMALL_TOE, 1] - keypoints[:, WHOLEBODY_LEFT_RING_BASE, 1]
+        right = keypoints[:, WHOLEBODY_RIGHT_SMALL_TOE, 1] - keypoints[:, WHOLEBODY_RIGHT_RING_BASE, 1]
+        return left / ratio, right / ratio
+
+    left_before, right_before = hand_to_foot(before_keypoints)
+    left_after, right_after = hand_to_foot(after_keypoints)
+    return np.stack([
+        np.abs(round_like_python(left_before - left_after, 1)),
+        np.abs(round_like_python(right_before - right_after, 1)),
+    ], axis=1)
+
+#Cervical rotation in degrees
+def cervical_rotation(before_world_landmarks, after_world_landmarks):
+    def nose_from_shoulders(world_landmarks):
+        midpoint = (world_landmarks[:, LEFT_SHOULDER] + world_landmarks[:, RIGHT_SHOULDER]) / 2
+        return world_landmarks[:, NOSE] - midpoint
+
+    before = nose_from_shoulders(before_world_landmarks)
+    after = nose_from_shoulders(after_world_landmarks)
+    dot_product = before[:, 0] * after[:, 0] + before[:, 2] * after[:, 2]
+    magnitude_before = np.sqrt(before[:, 0] ** 2 + before[:, 2] ** 2)
+    magnitude_after = np.sqrt(after[:, 0] ** 2 + after[:, 2] ** 2)
+    with np.errstate(invalid='ignore'):
+        angle = np.degrees(np.arccos(dot_product / (magnitude_before * magnitude_after)))
+    return np.abs(round_like_python(angle, 1))
+
+#Intermalleolar distance in cm from MediaPipe world landmarks
+def intermalleolar_distance(world_landmarks):
+    result = euclidean_distance(world_landmarks[:, LEFT_HEEL], world_landmarks[:, RIGHT_HEEL])
+    return np.abs(round_like_python(result * 100, 1))
@@ -0,0 +1,196 @@
+import numpy as np
+
+import measurement_kernels as kernels
+from landmarks import (
+    H36M_HEAD, H36M_JOINTS, H36M_THORAX, LEFT_ANKLE, LEFT_FOOT_INDEX, LEFT_HEEL, LEFT_KNEE, LEFT_PINKY,
+    LEFT_SHOULDER, LEFT_WRIST, NOSE, POSE_LANDMARKS, RIGHT_FOOT_INDEX, RIGHT_HEEL, RIGHT_PINKY, RIGHT_SHOULDER,
+    WHOLEBODY_KEYPOINTS, WHOLEBODY_LEFT_RING_BASE, WHOLEBODY_LEFT_SMALL_TOE, WHOLEBODY_RIGHT_ANKLE,
+    WHOLEBODY_RIGHT_KNEE, WHOLEBODY_RIGHT_RING_BASE, WHOLEBODY_RIGHT_SMALL_TOE)
+
+#Every BASMI measurement declared once: the models each of its images runs, the landmarks it reads from each and the
+#kernel computing it. A session works out its inferences and landmark gathers from these declarations, so a new
+#variant is one entry in MEASUREMENTS and shares every inference already run for the others
+
+#Order models run in within a session, cheapest first
+MODEL_ORDER = ("mediapipe", "wholebody", "human3d")
+
+#Landmarks of one image of N sessions as the kernels take them: (N, K, 3) float64 arrays per model, MediaPipe in both
+#its spaces, NaN where a landmark was not gathered, and (N, 2) image heights and widths
+class ImageLandmarks:
+    def __init__(self, count):
+        self.shape = np.full((count, 2), np.nan)
+        self.mediapipe = np.full((count, POSE_LANDMARKS, 3), np.nan)
+        self.world = np.full((count, POSE_LANDMARKS, 3), np.nan)
+        self.wholebody = np.full((count, WHOLEBODY_KEYPOINTS, 3), np.nan)
+        self.human3d = np.full((count, H36M_JOINTS, 3), np.nan)
+
+    #Gathers landmarks from inference outputs, input: one dict of model -> output (plus the image "shape") per
+    #session, dict of model -> landmark indices to gather
+    @classmethod
+    def from_outputs(cls, outputs, reads):
+        gathered = cls(len(outputs))
+        for row, output in enumerate(outputs):
+            gathered.shape[row] = output["shape"]
+            for model, indices in reads.items():
+                if model not in output:
+                    continue
+                indices = sorted(indices)
+                if model == "mediapipe":
+                    landmarks, world_landmarks = output[model]
+                    #No pose found leaves the row NaN
+                    if not world_landmarks:
+                        continue
+                    gathered.mediapipe[row, indices] = landmarks.xyz[indices]
+                    gathered.world[row, indices] = world_landmarks.xyz[indices]
+                else:
+                    points = np.asarray([output[model][index] for index in indices], dtype=np.float64)
+                    getattr(gathered, model)[row, indices, :points.shape[1]] = points
+        return gathered
+
+    #Stacks the landmarks kept in stored summaries (as written by summarise_landmarks), input: one summary per session
+    @classmethod
+    def from_summaries(cls, summaries):
+        gathered = cls(len(summaries))
+        for row, summary in enumerate(summaries):
+            gathered.shape[row] = summary.get("shape", (np.nan, np.nan))
+            for model in MODEL_ORDER:
+                for index, point in summary.get(model, {}).items():
+                    if model == "mediapipe":
+                        gathered.mediapipe[row, int(index)] = point["image"]
+                        gathered.world[row, int(index)] = point["world"]
+                    else:
+                        getattr(gathered, model)[row, int(index), :len(point)] = point
+        return gathered
+
+#One measurement, input: one dict per image argument of model -> landmark indices read from that image's output,
+#kernel taking one ImageLandmarks per image and returning N results, and for ROI crop mode the MediaPipe landmarks
+#spanning the body region each top-down model is run on
+class Measurement:
+    def __init__(self, images, formula, regions=None):
+        self.images = images
+        self.formula = formula
+        self.regions = regions or {}
+
+    #Models each image runs, cheapest first
+    @property
+    def models(self):
+        return tuple(tuple(model for model in MODEL_ORDER if model in reads) for reads in self.images)
+
+    #Every model the measurement runs
+    @property
+    def uses(self):
+        return {model for reads in self.images for model in reads}
+
+#Tragus (ear) to wall distance from the z coordinates of the head and base of the neck keypoints. No ROI region:
+#the lifter normalises the 2D keypoints by the person box's centre and scale, so a box other than the person
+#detector's would change the result, and the whole body it lifts leaves nothing to crop
+def tragus_to_wall():
+    return Measurement(
+        ({"human3d": (H36M_THORAX, H36M_HEAD)},),
+        lambda image: kernels.tragus(image.human3d))
+
+#Difference in the hand to floor distance before and after side flexing, calibrated by the shoulder to toe distance
+def side_flexion(hand, foot):
+    reads = {"mediapipe": tuple(dict.fromkeys((LEFT_SHOULDER, hand, LEFT_FOOT_INDEX, foot)))}
+    return Measurement(
+        (reads, reads),
+        lambda before, after: kernels.side_flexion(
+            before.shape, before.mediapipe, before.world, after.shape, after.mediapipe, after.world, hand, foot))
+
+#Difference in the fingertip to toe distance before and after flexing forward, scaled by the MediaPipe shin length.
+#Its wholebody keypoints (knee, ankle, toes, fingertips) are covered from the hips down plus the hands
+def lumbar_flexion():
+    keypoints = (
+        WHOLEBODY_RIGHT_KNEE, WHOLEBODY_RIGHT_ANKLE, WHOLEBODY_LEFT_SMALL_TOE, WHOLEBODY_RIGHT_SMALL_TOE,
+        WHOLEBODY_LEFT_RING_BASE, WHOLEBODY_RIGHT_RING_BASE)
+    return Measurement(
+        ({"mediapipe": (LEFT_KNEE, LEFT_ANKLE), "wholebody": keypoints}, {"wholebody": keypoints}),
+        lambda before, after: kernels.lumbar_flexion(
+            kernels.shin_length(before.world), before.wholebody, after.wholebody),
+        {"wholebody": tuple(range(LEFT_WRIST, POSE_LANDMARKS))})
+
+#Angle the nose rotates about the shoulder midpoint when the head is turned as far as possible
+def cervical_rotation():
+    reads = {"mediapipe": (NOSE, LEFT_SHOULDER, RIGHT_SHOULDER)}
+    return Measurement(
+        (reads, reads), lambda before, after: kernels.cervical_rotation(before.world, after.world))
+
+#Distance between the ankles when the legs are moved apart as far as possible
+def intermalleolar_distance():
+    return Measurement(
+        ({"mediapipe": (LEFT_HEEL, RIGHT_HEEL)},), lambda image: kernels.intermalleolar_distance(image.world))
+
+#PoseEstimator method name -> measurement, images in the method's argument order
+MEASUREMENTS = {
+    "tragus_to_wall_left": tragus_to_wall(),
+    "tragus_to_wall_right": tragus_to_wall(),
+    "side_flexion_left": side_flexion(LEFT_PINKY, LEFT_FOOT_INDEX),
+    "side_flexion_right": side_flexion(RIGHT_PINKY, RIGHT_FOOT_INDEX),
+    "lumbar_flexion": lumbar_flexion(),
+    "cervical_rotation_left": cervical_rotation(),
+    "cervical_rotation_right": cervical_rotation(),
+    "intermalleolar_distance": intermalleolar_distance(),
+}
+
+#Models each image of a session runs, input: dict of measurement name -> image indices in argument order, number of
+#images, output: per image, dict of model -> names of the measurements needing it
+def plan_models(measurements, count):
+    required = [{} for _ in range(count)]
+    for name, indices in measurements.items():
+        for index, models in zip(indices, MEASUREMENTS[name].models):
+            for model in models:
+                required[index].setdefault(model, []).append(name)
+    return required
+
+#Landmarks gathered from each image of a session, the union of what its measurements read, output: per image, dict
+#of model -> set of landmark indices
+def plan_gathers(measurements, count):
+    reads = [{} for _ in range(count)]
+    for name, indices in measurements.items():
+        for index, image_reads in zip(indices, MEASUREMENTS[name].images):
+            for model, landmarks in image_reads.items():
+                reads[index].setdefault(model, set()).update(landmarks)
+    return reads
+
+#Evaluates the measurements of one session together: each image's landmarks are gathered once for all of them, then
+#every kernel runs on the gathered arrays, input: dict of measurement name -> image indices, per-image dicts of
+#model -> output (plus the image "shape"), output: dict of measurement name -> result ((left, right) for lumbar
+#flexion), raises ValueError when a measurement's landmarks are missing or degenerate
+def evaluate(measurements, outputs):
+    gathered = [
+        ImageLandmarks.from_outputs([output], reads)
+        for output, reads in zip(outputs, plan_gathers(measurements, len(outputs)))
+    ]
+    results = {}
+    for name, indices in measurements.items():
+        result = MEASUREMENTS[name].formula(*[gathered[index] for index in indices])[0]
+        if not np.all(np.isfinite(result)):
+            raise ValueError(f"No measurable pose for {name}")
+        results[name] = tuple(result.tolist()) if result.ndim else result.item()
+    return results
+
+#Summary of the landmarks a measurement read from one image, kept with its stored result, input: the measurement's
+#dict of model -> landmark indices for that image, the image's dict of model -> output, output: dict of model ->
+#{landmark index: coordinates}, and the image's "shape" for side flexion's pixel calibration
+def summarise_landmarks(reads, output):
+    summary = {"shape": list(output["shape"])}
+    for model, indices in reads.items():
+        if model not in output:
+            continue
+        if model == "mediapipe":
+            landmarks, world_landmarks = output[model]
+            if not world_landmarks:
+                continue
+            summary[model] = {
+                str(index): {"image": landmarks.point(index), "world": world_landmarks.point(index)}
+                for index in indices
+            }
+        else:
+            summary[model] = {str(index): list(output[model][index]) for index in indices}
+    return summary
+
+#Recomputes one measurement for a cohort from the landmark summaries the measurement store keeps, input:
+#measurement name, list of per-session summaries (one list of per-image summaries each, as in a history row),
+#output: array of N results ((N, 2) for lumbar flexion)
+def rescore(name, sessions):
+    return MEASUREMENTS[name].formula(*[ImageLandmarks.from_summaries(list(image)) for image in zip(*sessions)])
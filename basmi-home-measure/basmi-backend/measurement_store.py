@@ -0,0 +1,131 @@
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    patient TEXT NOT NULL,
+    measurement TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    result TEXT NOT NULL,
+    models TEXT NOT NULL,
+    summary TEXT
+);
+CREATE INDEX IF NOT EXISTS measurements_history ON measurements (patient, measurement, recorded_at);
+"""
+
+INSERT = """
+INSERT INTO measurements (patient, measurement, recorded_at, result, models, summary) VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+#Persistent history of measurement results in SQLite. Writes are queued and committed in groups by one writer
+#thread, so requests never wait on the disk, reads use their own connection per thread and run alongside the
+#writer thanks to WAL mode
+class MeasurementStore:
+    def __init__(self, path, batch_size=256, flush_seconds=0.05, queue_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.readers = threading.local()
+
+        connection = self.connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self.writer = threading.Thread(target=self.write, name='measurement-store', daemon=True)
+        self.writer.start()
+
+    def connect(self):
+        connection = sqlite3.connect(self.path)
+        #WAL lets readers run while a group is committed, NORMAL syncs once per checkpoint rather than per commit
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    #Queues one result for writing, returns straight away, input: patient/device key, measurement name, result,
+    #dict of model -> identity, per-image landmark summaries
+    def record(self, patient, measurement, result, models, summary=None):
+        row = (
+            patient, measurement, time.time(), json.dumps(result), json.dumps(models),
+            json.dumps(summary) if summary is not None else None,
+        )
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            metrics.STORE_WRITES.inc('dropped')
+            logger.warning("Measurement store queue full, dropping a %s result", measurement)
+
+    #Writer thread: waits for a row, gathers whatever else arrives within flush_seconds, commits them together
+    def write(self):
+        connection = self.connect()
+        stopping = False
+        while not stopping:
+            row = self.queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = time.monotonic() + self.flush_seconds
+            while len(rows) < self.batch_size:
+                try:
+                    row = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+
+            try:
+                with connection:
+                    connection.executemany(INSERT, rows)
+                metrics.STORE_WRITES.inc('written', amount=len(rows))
+            except sqlite3.Error:
+                metrics.STORE_WRITES.inc('failed', amount=len(rows))
+                logger.exception("Writing %d measurements failed", len(rows))
+        connection.close()
+
+    #Results of one patient in time order, input: patient key, measurement name (all when None), time range in
+    #epoch seconds, most rows to return, output: list of dicts
+    def history(self, patient, measurement=None, since=None, until=None, limit=1000):
+        connection = getattr(self.readers, 'connection', None)
+        if connection is None:
+            connection = self.readers.connection = self.connect()
+
+        query = "SELECT measurement, recorded_at, result, models, summary FROM measurements WHERE patient = ?"
+        parameters = [patient]
+        if measurement is not None:
+            query += " AND measurement = ?"
+            parameters.append(measurement)
+        if since is not None:
+            query += " AND recorded_at >= ?"
+            parameters.append(since)
+        if until is not None:
+            query += " AND recorded_at < ?"
+            parameters.append(until)
+        query += " ORDER BY recorded_at LIMIT ?"
+        parameters.append(limit)
+
+        return [
+            {
+                "measurement": name,
+                "recorded_at": recorded_at,
+                "result": json.loads(result),
+                "models": json.loads(models),
+                "summary": json.loads(summary) if summary is not None else None,
+            }
+            for name, recorded_at, result, models, summary in connection.execute(query, parameters)
+        ]
+
+    #Writes whatever is queued and stops the writer thread
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
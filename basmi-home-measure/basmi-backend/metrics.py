@@ -0,0 +1,174 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+#Endpoint label for the request being handled, copied into inference worker threads with the request's context
+ENDPOINT = contextvars.ContextVar('basmi_endpoint', default='none')
+#List collecting observations made inside a pool worker process so the parent can replay them, None when not capturing
+_CAPTURE = contextvars.ContextVar('basmi_capture', default=None)
+
+#Latency buckets in seconds, from fast geometry up to slow CPU 3D inference
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+#Monotonic counter with labels
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        self.apply(label_values, amount)
+        capture = _CAPTURE.get()
+        if capture is not None:
+            capture.append((self.name, label_values, amount))
+
+    def apply(self, label_values, amount):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}' for labels, value in items]
+
+#Histogram with fixed buckets and labels
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        #labels -> [per-bucket counts (last is +Inf), sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        self.apply(label_values, value)
+        capture = _CAPTURE.get()
+        if capture is not None:
+            capture.append((self.name, label_values, value))
+
+    def apply(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def render(self):
+        with self.lock:
+            items = sorted((labels, (list(counts), total)) for labels, (counts, total) in self.values.items())
+        lines = []
+        for labels, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket'
+                             f'{_format_labels(self.label_names, labels, [("le", _format_value(float(bound)))])} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.label_names, labels)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.label_names, labels)} {cumulative}')
+        return lines
+
+#Gauge read from a callback at scrape time, callback output: dict of label values tuple -> value
+class CallbackGauge:
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, label_names, callback):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.callback = callback
+
+    def render(self):
+        return [f'{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}'
+                for labels, value in sorted(self.callback().items())]
+
+#Collection of metrics rendered together in the Prometheus text exposition format
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    #Applies observations captured in a worker process to this process's metrics
+    def replay(self, observations):
+        for name, label_values, value in observations:
+            self.metrics[name].apply(tuple(label_values), value)
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'basmi_stage_seconds', 'Time spent in each stage of a measurement request', ('endpoint', 'stage')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'basmi_request_seconds', 'Total time to handle a request', ('endpoint',)))
+REQUESTS = REGISTRY.register(Counter(
+    'basmi_requests_total', 'Requests handled, by endpoint and HTTP status', ('endpoint', 'status')))
+ERRORS = REGISTRY.register(Counter(
+    'basmi_errors_total', 'Requests that failed or returned an error status', ('endpoint',)))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    'basmi_cache_lookups_total', 'Landmark cache lookups, by model and hit/miss', ('model', 'result')))
+INFERENCE_WAIT_SECONDS = REGISTRY.register(Histogram(
+    'basmi_inference_wait_seconds', 'Time requests wait in a model pool\'s queue before a worker picks them up',
+    ('pool',)))
+INFERENCE_REJECTED = REGISTRY.register(Counter(
+    'basmi_inference_rejected_total', 'Requests rejected because a model pool\'s queue was full', ('pool',)))
+STORE_WRITES = REGISTRY.register(Counter(
+    'basmi_store_writes_total', 'Results sent to the measurement store, by written/dropped/failed', ('result',)))
+CASCADE_INFERENCES = REGISTRY.register(Counter(
+    'basmi_cascade_inferences_total',
+    'Lite landmarker runs in cascade mode (cache hits left out), by kept (confident) or escalated to the full model',
+    ('result',)))
+LIVE_FRAMES = REGISTRY.register(Counter(
+    'basmi_live_frames_total', 'Frames received on live streams, by endpoint and processed/dropped', ('endpoint', 'result')))
+
+#Times the enclosed block as one stage of the current endpoint's request
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, ENDPOINT.get(), name)
+
+#Records every observation made inside the block, used by pool workers to send their metrics back with the result
+@contextmanager
+def capture():
+    observations = []
+    token = _CAPTURE.set(observations)
+    try:
+        yield observations
+    finally:
+        _CAPTURE.reset(token)
@@ -0,0 +1,70 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+#Gathers concurrent single-image requests for one model into a batch, runs one batched call and scatters the results
+class MicroBatcher:
+    def __init__(self, batch_function, max_batch_size, window_seconds, name='batcher'):
+        self.batch_function = batch_function
+        self.max_batch_size = max_batch_size
+        self.window_seconds = window_seconds
+        self.name = name
+        self.requests = queue.Queue()
+
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+        self.thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self.thread.start()
+
+    #Called from an inference worker thread, blocks until the batch containing item has run, output: item's result
+    def __call__(self, item):
+        future = Future()
+        self.requests.put((item, future))
+        return future.result()
+
+    #Waits for a first request, then keeps collecting until the window closes or the batch is full
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window_seconds
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            futures = [future for _, future in batch]
+            try:
+                results = self.batch_function([item for item, _ in batch])
+                #A short result list would leave the callers past its end waiting forever
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name} returned {len(results)} results for a batch of {len(batch)}")
+            except Exception as exc:
+                for future in futures:
+                    future.set_exception(exc)
+                continue
+
+            with self.lock:
+                self.batches += 1
+                self.items += len(batch)
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+    #Batch counts for monitoring, mean_batch_size near 1 means the window is too short for the traffic
+    def stats(self):
+        with self.lock:
+            return {
+                "batches": self.batches,
+                "items": self.items,
+                "mean_batch_size": self.items / self.batches if self.batches else 0.0,
+                "pending": self.requests.qsize(),
+            }
@@ -0,0 +1,58 @@
+from inference_executor import InferenceExecutor
+from measurement_registry import MEASUREMENTS, MODEL_ORDER
+from worker_pool import ProcessEstimatorPool
+
+#Pool a measurement runs on: the slowest model it needs (MODEL_ORDER is cheapest first), so MediaPipe-only
+#measurements never wait behind wholebody or human3d inference
+def measurement_pool(method):
+    return max(MEASUREMENTS[method].uses, key=MODEL_ORDER.index)
+
+#One bounded worker pool and queue per model, and the object each pool measures with: the estimator itself, or in
+#pool mode worker processes forked for that pool alone. Requests are routed by the models their measurements need
+class ModelRouter:
+    def __init__(self, estimator, limits):
+        #limits: pool name -> (worker threads, waiting queue size), one pool per model in MODEL_ORDER
+        self.limits = limits
+        self.executors = {
+            pool: InferenceExecutor(workers, queue_size, pool) for pool, (workers, queue_size) in limits.items()
+        }
+        self.forked = False
+        self.measure_with(estimator)
+
+    #Points every pool at one estimator
+    def measure_with(self, estimator):
+        self.poses = dict.fromkeys(self.limits, estimator)
+
+    #Pool mode: forks one worker process per worker thread of each pool, so a busy pool never holds the processes
+    #of another, warm_up: each worker warms up the models it rebuilds after the fork before the pool is used
+    def fork(self, estimator, threads_per_process, warm_up=False):
+        self.poses = {
+            pool: ProcessEstimatorPool(estimator, workers, threads_per_process, warm_up)
+            for pool, (workers, _) in self.limits.items()
+        }
+        self.forked = True
+
+    #Pool a session runs on: the slowest pool of its measurements
+    def session_pool(self, methods):
+        return max((measurement_pool(method) for method in methods), key=MODEL_ORDER.index)
+
+    #Object a pool measures with
+    def pose(self, pool):
+        return self.poses[pool]
+
+    #Runs function(*args) on a pool's workers, raising QueueFullError when that pool's queue is full
+    async def run(self, pool, function, *args):
+        return await self.executors[pool].run(function, *args)
+
+    def workers(self):
+        return sum(workers for workers, _ in self.limits.values())
+
+    def stats(self):
+        return {pool: executor.stats() for pool, executor in self.executors.items()}
+
+    def shutdown(self):
+        for executor in self.executors.values():
+            executor.shutdown()
+        if self.forked:
+            for pose in self.poses.values():
+                pose.shutdown()
@@ -0,0 +1,259 @@
+import os
+
+import cv2
+import numpy as np
+
+#ONNX Runtime versions of the MMPose models behind wholebody and human3d, exported by export_onnx.py from the same
+#checkpoints the MMPoseInferencer aliases resolve to. Pre- and post-processing follow MMPose's test pipelines step by
+#step (letterbox, top-down affine, SimCC argmax, flip test, MotionBERT encoding and decoding), so keypoints come out in
+#the same layout and coordinates as result['predictions'][0][0]['keypoints']
+
+#Model files in the ONNX model directory
+DETECTOR_FILE = 'detector.onnx'
+WHOLEBODY_FILE = 'wholebody.onnx'
+HUMAN_FILE = 'human.onnx'
+LIFTER_FILE = 'lifter.onnx'
+
+#Precision profiles: 'float' runs the models as exported, 'int8' the pose models quantized by export_onnx.py. The
+#person detector stays float in every profile, each keypoint depends on its box
+PROFILES = ('float', 'int8')
+QUANTIZED_FILES = (WHOLEBODY_FILE, HUMAN_FILE, LIFTER_FILE)
+
+#RTMDet person detector: square letterbox input, BGR normalisation, output strides of its three levels
+DETECTOR_SIZE = 640
+DETECTOR_PAD = 114
+DETECTOR_MEAN = np.array([103.53, 116.28, 123.675], dtype=np.float32)
+DETECTOR_STD = np.array([57.375, 57.12, 58.395], dtype=np.float32)
+DETECTOR_STRIDES = (8, 16, 32)
+#Lowest score of a person box, MMPose's bbox_thr, the whole image is used when no box reaches it
+DETECTOR_SCORE = 0.3
+
+#RTMPose/RTMW top-down models: input width and height, box padding, RGB normalisation, SimCC bins per pixel
+POSE_SIZE = (192, 256)
+POSE_PADDING = 1.25
+POSE_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+POSE_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+SIMCC_SPLIT_RATIO = 2.0
+
+#Index of each keypoint's mirror image, for the flip test
+COCO_FLIP = [0, 2, 1, 4, 3, 6, 5, 8, 7, 10, 9, 12, 11, 14, 13, 16, 15]
+#68 point face of COCO-WholeBody: jaw, brows, nose bridge, nostrils, eyes, outer and inner lips
+FACE_FLIP = (
+    list(range(16, -1, -1)) + list(range(26, 16, -1)) + [27, 28, 29, 30] + list(range(35, 30, -1))
+    + [45, 44, 43, 42, 47, 46, 39, 38, 37, 36, 41, 40]
+    + list(range(54, 47, -1)) + list(range(59, 54, -1)) + list(range(64, 59, -1)) + [67, 66, 65]
+)
+#COCO-WholeBody: body, feet (left 17-19, right 20-22), face (23-90), hands (left 91-111, right 112-132)
+WHOLEBODY_FLIP = (
+    COCO_FLIP + [20, 21, 22, 17, 18, 19] + [23 + index for index in FACE_FLIP]
+    + list(range(112, 133)) + list(range(91, 112))
+)
+H36M_FLIP = [0, 4, 5, 6, 1, 2, 3, 7, 8, 9, 10, 14, 15, 16, 11, 12, 13]
+
+#MotionBERT lifter: 2D poses are normalised to the Human3.6M framing before lifting, z is scaled back per image width
+H36M_BBOX_CENTER = np.array([528.0, 427.0], dtype=np.float32)
+H36M_BBOX_SCALE = 400.0
+LIFTER_FACTOR = 4.0
+
+#File name of a model in a profile, quantized models sit next to the float ones as e.g. wholebody.int8.onnx
+def profile_file(file_name, profile):
+    if profile == 'float' or file_name not in QUANTIZED_FILES:
+        return file_name
+    root, extension = os.path.splitext(file_name)
+    return f"{root}.{profile}{extension}"
+
+#ONNX Runtime session on the CPU, threads 0 lets ONNX Runtime use every core
+def create_session(path, threads=0):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+
+#Runs a session on one input array, output: list of output arrays
+def run_session(session, inputs):
+    return session.run(None, {session.get_inputs()[0].name: inputs})
+
+#COCO body keypoints to the Human3.6M skeleton the lifter expects, as MMPose's convert_keypoint_definition,
+#input: (N, 17, C) array, output: (N, 17, C) array
+def coco_to_h36m(keypoints):
+    converted = np.zeros_like(keypoints)
+    #Pelvis, thorax and spine are midpoints, head is between the eyes
+    converted[:, 0] = (keypoints[:, 11] + keypoints[:, 12]) / 2
+    converted[:, 8] = (keypoints[:, 5] + keypoints[:, 6]) / 2
+    converted[:, 7] = (converted[:, 0] + converted[:, 8]) / 2
+    converted[:, 10] = (keypoints[:, 1] + keypoints[:, 2]) / 2
+    converted[:, [1, 2, 3, 4, 5, 6, 9, 11, 12, 13, 14, 15, 16]] = \
+        keypoints[:, [12, 14, 16, 11, 13, 15, 0, 5, 7, 9, 6, 8, 10]]
+    return converted
+
+#RTMDet exported without its NMS: per level class logits and box distances in input pixels. Only the best scoring
+#person is kept, which is the box MMPose's predictions[0] comes from since NMS always keeps the top box
+class PersonDetector:
+    def __init__(self, path, threads=0):
+        self.session = create_session(path, threads)
+
+    #Letterboxes an RGB image into the detector's square BGR input, output: (3, size, size) array, x and y resize
+    #factors, resized width and height
+    def preprocess(self, pixels):
+        height, width = pixels.shape[:2]
+        scale = DETECTOR_SIZE / max(height, width)
+        resized_width, resized_height = int(width * scale + 0.5), int(height * scale + 0.5)
+        resized = cv2.resize(np.ascontiguousarray(pixels[:, :, ::-1]), (resized_width, resized_height), interpolation=cv2.INTER_LINEAR)
+        canvas = np.full((DETECTOR_SIZE, DETECTOR_SIZE, 3), DETECTOR_PAD, dtype=np.float32)
+        canvas[:resized_height, :resized_width] = resized
+        canvas = (canvas - DETECTOR_MEAN) / DETECTOR_STD
+        return canvas.transpose(2, 0, 1), (resized_width / width, resized_height / height), (resized_width, resized_height)
+
+    #Best person box of each image, input: list of RGB images, output: (N, 5) array of x1, y1, x2, y2 boxes in
+    #image pixels and their scores, the whole image with score 1 when no person scores above the threshold
+    def detect(self, images):
+        prepared = [self.preprocess(pixels) for pixels in images]
+        outputs = run_session(self.session, np.stack([inputs for inputs, _, _ in prepared]))
+        levels = len(DETECTOR_STRIDES)
+        boxes = []
+        for index, (pixels, (_, (scale_x, scale_y), (resized_width, resized_height))) in enumerate(zip(images, prepared)):
+            height, width = pixels.shape[:2]
+            best_score, best_box = DETECTOR_SCORE, None
+            for stride, scores, distances in zip(DETECTOR_STRIDES, outputs[:levels], outputs[levels:]):
+                scores = scores[index, 0]
+                position = int(np.argmax(scores))
+                score = 1 / (1 + np.exp(-scores.flat[position]))
+                if score <= best_score:
+                    continue
+                row, column = divmod(position, scores.shape[1])
+                left, top, right, bottom = distances[index, :, row, column]
+                x, y = column * stride, row * stride
+                box = np.array([
+                    min(max(x - left, 0), resized_width), min(max(y - top, 0), resized_height),
+                    min(max(x + right, 0), resized_width), min(max(y + bottom, 0), resized_height),
+                ], dtype=np.float32)
+                best_score, best_box = score, box / [scale_x, scale_y, scale_x, scale_y]
+            if best_box is None:
+                boxes.append([0, 0, width, height, 1.0])
+            else:
+                boxes.append([*best_box, best_score])
+        return np.array(boxes, dtype=np.float32).reshape(-1, 5)
+
+#RTMPose/RTMW SimCC model run top-down on person boxes with the flip test MMPose's configs enable
+class TopdownPoseModel:
+    def __init__(self, path, flip_indices, threads=0):
+        self.session = create_session(path, threads)
+        self.flip_indices = flip_indices
+
+    #Centre and aspect-fixed size of the area cropped around a box, as GetBBoxCenterScale and TopdownAffine
+    def crop_area(self, box):
+        center = np.array([(box[0] + box[2]) / 2, (box[1] + box[3]) / 2], dtype=np.float32)
+        width, height = (box[2] - box[0]) * POSE_PADDING, (box[3] - box[1]) * POSE_PADDING
+        aspect = POSE_SIZE[0] / POSE_SIZE[1]
+        if width > height * aspect:
+            height = width / aspect
+        else:
+            width = height * aspect
+        return center, np.array([width, height], dtype=np.float32)
+
+    #Warps the box area to the model input, output: (3, h, w) normalised array
+    def preprocess(self, pixels, center, size):
+        scale = POSE_SIZE[0] / size[0]
+        matrix = np.array([
+            [scale, 0, POSE_SIZE[0] / 2 - center[0] * scale],
+            [0, scale, POSE_SIZE[1] / 2 - center[1] * scale],
+        ], dtype=np.float32)
+        crop = cv2.warpAffine(np.ascontiguousarray(pixels), matrix, POSE_SIZE, flags=cv2.INTER_LINEAR)
+        crop = (crop.astype(np.float32) - POSE_MEAN) / POSE_STD
+        return crop.transpose(2, 0, 1)
+
+    #Model input for one person per box: the crops followed by their mirror images, input: RGB images, one box per
+    #image, output: (2N, 3, h, w) array, crop areas
+    def prepare(self, images, boxes):
+        areas = [self.crop_area(box) for box in boxes]
+        inputs = np.stack([self.preprocess(pixels, *area) for pixels, area in zip(images, areas)])
+        return np.concatenate([inputs, inputs[..., ::-1]]), areas
+
+    #Keypoints of one person per box, input: RGB images, one box per image, output: (N, K, 2) keypoints in image
+    #pixels, (N, K) scores
+    def predict(self, images, boxes):
+        inputs, areas = self.prepare(images, boxes)
+        #Original and mirrored crops in one run, the mirrored result is flipped back and averaged
+        simcc_x, simcc_y = run_session(self.session, inputs)[:2]
+        count = len(areas)
+        flipped_x = simcc_x[count:, self.flip_indices, ::-1]
+        flipped_y = simcc_y[count:, self.flip_indices]
+        simcc_x = (simcc_x[:count] + flipped_x) * 0.5
+        simcc_y = (simcc_y[:count] + flipped_y) * 0.5
+
+        keypoints = np.stack([simcc_x.argmax(axis=2), simcc_y.argmax(axis=2)], axis=-1).astype(np.float32)
+        scores = np.minimum(simcc_x.max(axis=2), simcc_y.max(axis=2))
+        keypoints[scores <= 0] = -1
+        keypoints /= SIMCC_SPLIT_RATIO
+
+        for index, (center, size) in enumerate(areas):
+            keypoints[index] = keypoints[index] / POSE_SIZE * size + center - 0.5 * size
+        return keypoints, scores
+
+#MotionBERT lifting a single frame of 2D Human3.6M keypoints to 3D, with the flip test
+class PoseLifter:
+    def __init__(self, path, threads=0):
+        self.session = create_session(path, threads)
+
+    #Model input: the normalised keypoints followed by their mirror images, input: (N, 17, 2) keypoints in image
+    #pixels, (N, 4) person boxes, (N, 2) image heights and widths, output: (2N, 1, 17, 3) array
+    def prepare(self, keypoints, boxes, shapes):
+        heights, widths = shapes[:, 0:1].astype(np.float32), shapes[:, 1:2].astype(np.float32)
+        centers = (boxes[:, :2] + boxes[:, 2:4]) / 2
+        scales = np.maximum(boxes[:, 2] - boxes[:, 0], boxes[:, 3] - boxes[:, 1])
+        keypoints = (keypoints - centers[:, None]) / scales[:, None, None] * H36M_BBOX_SCALE + H36M_BBOX_CENTER
+        #Image coordinates to [-1, 1] across the width, with every keypoint marked visible
+        keypoints = keypoints / widths[:, None] * 2 - np.concatenate([np.ones_like(widths), heights / widths], 1)[:, None]
+        inputs = np.concatenate([keypoints, np.ones(keypoints.shape[:2] + (1,), dtype=np.float32)], axis=2)
+        inputs = inputs[:, None].astype(np.float32)
+
+        mirrored = inputs.copy()
+        mirrored[..., 0] *= -1
+        return np.concatenate([inputs, mirrored[:, :, H36M_FLIP]])
+
+    #Input: (N, 17, 2) keypoints in image pixels, (N, 4) person boxes, (N, 2) image heights and widths,
+    #output: (N, 17, 3) keypoints as MMPose's Pose3DInferencer returns them
+    def lift(self, keypoints, boxes, shapes):
+        widths = shapes[:, 1:2].astype(np.float32)
+        outputs = run_session(self.session, self.prepare(keypoints, boxes, shapes))[0]
+        count = len(keypoints)
+        flipped = outputs[count:, :, H36M_FLIP]
+        flipped[..., 0] *= -1
+        lifted = ((outputs[:count] + flipped) * 0.5)[:, 0]
+
+        #Root relative, back to millimetres of the image width, then metres
+        lifted[:, 0] = 0
+        lifted = lifted * (widths[:, None] / 2 * LIFTER_FACTOR / 1000)
+
+        #Pose3DInferencer's axes: z up, x mirrored, standing on z = 0
+        lifted = lifted[..., [0, 2, 1]]
+        lifted[..., 0] *= -1
+        lifted[..., 2] *= -1
+        lifted[..., 2] -= lifted[..., 2].min(axis=1, keepdims=True)
+        return lifted
+
+#wholebody on ONNX Runtime, input: list of RGB images, their person boxes from PersonDetector, output: list of 133
+#[x, y] keypoints per image
+class OnnxWholebody:
+    def __init__(self, pose):
+        self.pose = pose
+
+    def predict(self, images, boxes):
+        keypoints, _ = self.pose.predict(images, boxes)
+        return [image_keypoints.tolist() for image_keypoints in keypoints]
+
+#human3d on ONNX Runtime: COCO body keypoints, converted and lifted, input: list of RGB images, their person boxes
+#from PersonDetector, output: list of 17 [x, y, z] Human3.6M keypoints per image
+class OnnxHuman3d:
+    def __init__(self, pose, lifter):
+        self.pose = pose
+        self.lifter = lifter
+
+    def predict(self, images, boxes):
+        keypoints, _ = self.pose.predict(images, boxes)
+        shapes = np.array([pixels.shape[:2] for pixels in images])
+        lifted = self.lifter.lift(coco_to_h36m(keypoints), boxes, shapes)
+        return [image_keypoints.tolist() for image_keypoints in lifted]
@@ -1,297 +1,626 @@
 import os
-import math
+import threading
 
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'TRUE'
 
-import mediapipe as mp
-from mediapipe.tasks import python
-from mediapipe import solutions
-from mediapipe.tasks.python import vision
-from mediapipe.framework.formats import landmark_pb2
+#MediaPipe and MMPose are imported when their models are loaded, so importing this module stays cheap
+import numpy as np
 
-from mmpose.apis import MMPoseInferencer
+import metrics
+from image_io import load_image, original_shape, to_original_coordinates
+from landmark_cache import LandmarkCache, image_digest
+from landmarks import pose_landmarks
+from measurement_registry import MEASUREMENTS, MODEL_ORDER, evaluate, plan_gathers, plan_models, summarise_landmarks
+from micro_batcher import MicroBatcher
+
+#MMPose follows the OpenCV convention of BGR pixel arrays, input: image (RGB array, bytes or path), output: BGR array
+def to_bgr(image):
+    return np.ascontiguousarray(load_image(image)[:, :, ::-1])
+
+#Inference profiles, the MediaPipe landmarker each one runs: 'fast' the lite model, 'balanced' the full model and
+#'accurate' the heavy model, each a .task file from MediaPipe's pose landmarker models in the working directory
+PROFILES = {
+    "fast": 'pose_landmarker_lite.task',
+    "balanced": 'pose_landmarker_full.task',
+    "accurate": 'pose_landmarker_heavy.task',
+}
+
+#Lowest score of a person box from the shared detector, MMPose's bbox_thr
+PERSON_SCORE = 0.3
+
+#Stands in for the person detector of an MMPose inferencer built without one: hands MMPose the box found by the
+#shared person detection stage, so MMPose's own top-down pipeline runs from that box. Set box before each call
+class GivenPersonBox:
+    def __init__(self):
+        self.box = None
 
-import cv2
-import numpy as np
+    def __call__(self, inputs, return_datasamples=True, **kwargs):
+        from mmengine.structures import BaseDataElement, InstanceData
 
-#2D calculation of distance
-def distance_between_points(point_one, point_two):
-    return math.sqrt((point_one[0] - point_two[0]) ** 2 + (point_one[1] - point_two[1]) ** 2)
+        pred_instances = InstanceData(
+            bboxes=np.array([self.box[:4]], dtype=np.float32),
+            scores=np.array([self.box[4]], dtype=np.float32),
+            labels=np.zeros(1, dtype=np.int64))
+        return {'predictions': [BaseDataElement(pred_instances=pred_instances)]}
 
-#3D calculation of distance
-def euclidean_distance(point1, point2):
-    return math.sqrt((point1[0] - point2[0])**2 + (point1[1] - point2[1])**2 + (point1[2] - point2[2])**2)
+#Builds an MMPose inferencer without its own person detector, output: (inferencer, its GivenPersonBox)
+def without_detector(inferencer, pose2d):
+    given_box = GivenPersonBox()
+    pose2d.detector = given_box
+    pose2d.det_cat_ids = (0,)
+    return inferencer, given_box
 
 #Combined pose estimator of best performing framework and models
 class PoseEstimator:
-    def __init__(self):
-        #MediaPipe setup
-        self.model_path = 'pose_landmarker_full.task'
-        self.base_options = python.BaseOptions(model_asset_path=self.model_path)
-        self.options = vision.PoseLandmarkerOptions(
-            base_options=self.base_options,
-            output_segmentation_masks=True)
-        self.detector = vision.PoseLandmarker.create_from_options(self.options)
-
-        #MMPose with wholebody setup (2D)
-        self.inferencer_2d = MMPoseInferencer('wholebody')
-        #MMPose with human3d setup (3D)
-        self.inferencer_3d = MMPoseInferencer(pose3d='human3d')
-
-    #MediaPipe image inference to gain human landmarks, input: image path, output: landmarks data
-    def media_pipe_inference(self, input_path):
-        image = mp.Image.create_from_file(input_path)
-        detection_result = self.detector.detect(image)
-
-        #Normalised landmarks: x and y normalised between 0 and 1 in reference to image width and height respectively
-        pose_landmarks_list = detection_result.pose_landmarks
-        #World landmarks: point in 3D space with x,y,z in metres, with z representing the landmark depth
-        pose_world_landmarks_list  = detection_result.pose_world_landmarks
-
-        landmarks_data = []
-        world_landmarks_data = []
-
-        #Add generated landmarks to lists
-        if pose_landmarks_list:
-            for idx in range(len(pose_landmarks_list)):
-                for i, lm in enumerate(pose_landmarks_list[idx]):
-                    landmarks_data.append({
-                        "id": i,
-                        "x": lm.x,
-                        "y": lm.y,
-                        "z": lm.z
-                    })
-
-
-            if pose_world_landmarks_list:
-                for idx in range(len(pose_world_landmarks_list)):
-                    for i, lm in enumerate(pose_world_landmarks_list[idx]):
-                        world_landmarks_data.append({
-                            "id": i,
-                            "x": lm.x,
-                            "y": lm.y,
-                            "z": lm.z
-                        })
-
-        return landmarks_data, world_landmarks_data
-
-    #MMPose with wholebody image inference to gain human keypoints, input: image path, output: keypoints data
-    def wholebody_inference(self, input_path):
-        result_generator = self.inferencer_2d(input_path, draw_bbox=True) #Draw bounding boxes to estimate wall
-        result = next(result_generator)
+    def __init__(self, batch_max_size=1, batch_window=0.0, cache_bytes=0, lazy=False, backend='mmpose',
+                 onnx_dir='onnx', onnx_threads=0, onnx_profile='float', roi_crop=False, roi_margin=0.15,
+                 profile='balanced', cascade=False, cascade_threshold=0.5):
+        #MediaPipe setup, models are created by the load_* methods, straight away or on first use when lazy. The
+        #profile picks the landmarker variant
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown inference profile: {profile}")
+        self.profile = profile
+        self.model_path = PROFILES[profile]
+        self.detector = None
+        #Cascade mode runs the lite landmarker first and escalates to the profile's landmarker when the landmarks a
+        #measurement reads have visibility or presence below cascade_threshold
+        if cascade and PROFILES[profile] == PROFILES["fast"]:
+            raise ValueError("Cascade mode needs a profile heavier than fast")
+        self.cascade = cascade
+        self.cascade_threshold = cascade_threshold
+        self.lite_detector = None
+        self.inferencer_2d = None
+        self.inferencer_3d = None
+        self.load_lock = threading.Lock()
+
+        #wholebody and human3d run on MMPose ('mmpose') or on ONNX Runtime from exported models in onnx_dir ('onnx'),
+        #onnx_threads 0 lets ONNX Runtime use every core, onnx_profile 'float' or 'int8' (quantized pose models)
+        if backend not in ('mmpose', 'onnx'):
+            raise ValueError(f"Unknown pose backend: {backend}")
+        if onnx_profile not in ('float', 'int8'):
+            raise ValueError(f"Unknown ONNX profile: {onnx_profile}")
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.onnx_threads = onnx_threads
+        self.onnx_profile = onnx_profile
+
+        #One person detector for wholebody and human3d, run once per image, its box is handed to both top-down models
+        self.person_detector = None
+        self.wholebody_box = None
+        self.human3d_box = None
+
+        #ROI crop mode runs the top-down models from a box around the landmarks a measurement reads, found by
+        #MediaPipe instead of the person detector, widened by roi_margin of its longest side
+        self.roi_crop = roi_crop
+        self.roi_margin = roi_margin
+
+        #The detector and inferencers are not thread-safe, one lock per model lets different models run concurrently
+        self.mediapipe_lock = threading.Lock()
+        self.lite_lock = threading.Lock()
+        self.person_lock = threading.Lock()
+        self.wholebody_lock = threading.Lock()
+        self.human3d_lock = threading.Lock()
+
+        #Concurrent wholebody requests are gathered into batches when batch_max_size > 1, window in seconds
+        self.batch_max_size = batch_max_size
+        self.batch_window = batch_window
+        self.start_batchers()
+
+        #Inference outputs keyed by image content and model, a retried or duplicated upload costs a hash
+        self.cache = LandmarkCache(cache_bytes) if cache_bytes else None
+
+        if not lazy:
+            self.load()
+
+    #Creates the MediaPipe landmarker if it does not exist yet
+    def load_media_pipe(self):
+        with self.load_lock:
+            if self.detector is None:
+                from mediapipe.tasks import python
+                from mediapipe.tasks.python import vision
+
+                self.base_options = python.BaseOptions(model_asset_path=self.model_path)
+                #No measurement reads the segmentation masks, so MediaPipe does not produce them
+                self.options = vision.PoseLandmarkerOptions(
+                    base_options=self.base_options,
+                    output_segmentation_masks=False)
+                self.detector = vision.PoseLandmarker.create_from_options(self.options)
+        return self.detector
+
+    #Creates the lite landmarker of cascade mode if it does not exist yet
+    def load_media_pipe_lite(self):
+        with self.load_lock:
+            if self.lite_detector is None:
+                from mediapipe.tasks import python
+                from mediapipe.tasks.python import vision
+
+                options = vision.PoseLandmarkerOptions(
+                    base_options=python.BaseOptions(model_asset_path=PROFILES["fast"]),
+                    output_segmentation_masks=False)
+                self.lite_detector = vision.PoseLandmarker.create_from_options(options)
+        return self.lite_detector
+
+    #Path of an exported model in the ONNX model directory, in this estimator's profile
+    def onnx_path(self, file_name):
+        import onnx_backend
+
+        return os.path.join(self.onnx_dir, onnx_backend.profile_file(file_name, self.onnx_profile))
+
+    #Person detector shared by wholebody and human3d: RTMDet from MMDetection, with the checkpoint MMPose's top-down
+    #inferencers would each load, or its ONNX export
+    def load_person_detector(self):
+        with self.load_lock:
+            if self.person_detector is None:
+                if self.backend == 'onnx':
+                    import onnx_backend
+                    self.person_detector = onnx_backend.PersonDetector(
+                        self.onnx_path(onnx_backend.DETECTOR_FILE), self.onnx_threads)
+                else:
+                    from mmdet.apis import DetInferencer
+                    from mmpose.apis.inferencers.utils.default_det_models import default_det_models
+                    person = default_det_models['human']
+                    self.person_detector = DetInferencer(
+                        model=person['model'], weights=person['weights'], scope='mmdet', show_progress=False)
+        return self.person_detector
+
+    #wholebody setup (2D) on MMPose or ONNX Runtime, MMPose may resolve or download checkpoints on first load
+    def load_wholebody(self):
+        with self.load_lock:
+            if self.inferencer_2d is None:
+                if self.backend == 'onnx':
+                    import onnx_backend
+                    self.inferencer_2d = onnx_backend.OnnxWholebody(
+                        onnx_backend.TopdownPoseModel(
+                            self.onnx_path(onnx_backend.WHOLEBODY_FILE), onnx_backend.WHOLEBODY_FLIP,
+                            self.onnx_threads))
+                else:
+                    from mmpose.apis import MMPoseInferencer
+                    inferencer = MMPoseInferencer('wholebody', det_model='whole_image')
+                    self.inferencer_2d, self.wholebody_box = without_detector(inferencer, inferencer.inferencer)
+        return self.inferencer_2d
+
+    #human3d setup (3D) on MMPose or ONNX Runtime
+    def load_human3d(self):
+        with self.load_lock:
+            if self.inferencer_3d is None:
+                if self.backend == 'onnx':
+                    import onnx_backend
+                    self.inferencer_3d = onnx_backend.OnnxHuman3d(
+                        onnx_backend.TopdownPoseModel(
+                            self.onnx_path(onnx_backend.HUMAN_FILE), onnx_backend.COCO_FLIP, self.onnx_threads),
+                        onnx_backend.PoseLifter(self.onnx_path(onnx_backend.LIFTER_FILE), self.onnx_threads))
+                else:
+                    from mmpose.apis import MMPoseInferencer
+                    inferencer = MMPoseInferencer(pose3d='human3d', det_model='whole_image')
+                    self.inferencer_3d, self.human3d_box = without_detector(
+                        inferencer, inferencer.inferencer.pose2d_model)
+        return self.inferencer_3d
+
+    #Loads every model up front
+    def load(self):
+        self.load_media_pipe()
+        if self.cascade:
+            self.load_media_pipe_lite()
+        self.load_person_detector()
+        self.load_wholebody()
+        self.load_human3d()
+
+    #Runs one synthetic inference per model so one-time initialisation is paid before the first real request,
+    #top_down False warms MediaPipe only
+    def warm_up(self, top_down=True):
+        blank = np.full((480, 640, 3), 127, dtype=np.uint8)
+        self.run_media_pipe(blank)
+        if self.cascade:
+            self.run_media_pipe(blank, lite=True)
+        if not top_down:
+            return
+        box = self.run_person_detector(blank)
+        self.run_wholebody(blank, box)
+        self.run_human3d(blank, box)
+
+    #Starts the wholebody micro-batching thread, or none when batching is disabled. human3d is not batched: its lifter
+    #takes one image at a time, so a batch would only add the window's wait
+    def start_batchers(self):
+        self.wholebody_batcher = None
+        if self.batch_max_size > 1:
+            self.wholebody_batcher = MicroBatcher(
+                self.wholebody_inference_batch, self.batch_max_size, self.batch_window, 'batcher-wholebody')
+
+    #Called in a forked worker process: MediaPipe's graph threads, ONNX Runtime's thread pools, batcher threads and
+    #any held locks do not survive fork, the MMPose weights are kept and shared copy-on-write with the parent.
+    #threads: ONNX Runtime threads per session in this worker, unchanged when None
+    def after_fork(self, threads=None):
+        self.load_lock = threading.Lock()
+        if self.detector is not None:
+            self.detector = None
+            self.load_media_pipe()
+        if self.lite_detector is not None:
+            self.lite_detector = None
+            self.load_media_pipe_lite()
+        if self.backend == 'onnx':
+            if threads is not None:
+                self.onnx_threads = threads
+            loaded = [
+                load for load, model in (
+                    (self.load_person_detector, self.person_detector),
+                    (self.load_wholebody, self.inferencer_2d),
+                    (self.load_human3d, self.inferencer_3d),
+                ) if model is not None
+            ]
+            self.person_detector = self.inferencer_2d = self.inferencer_3d = None
+            for load in loaded:
+                load()
+        self.mediapipe_lock = threading.Lock()
+        self.lite_lock = threading.Lock()
+        self.person_lock = threading.Lock()
+        self.wholebody_lock = threading.Lock()
+        self.human3d_lock = threading.Lock()
+        #A worker runs one request at a time, its batches would never hold more than one item and every call would
+        #wait out the window
+        self.wholebody_batcher = None
+
+    #Warm-up in a forked worker, of the models after_fork rebuilt: MediaPipe's landmarkers, and the top-down models
+    #on ONNX Runtime. MMPose models keep the parent's warmed-up state
+    def warm_up_after_fork(self):
+        self.warm_up(top_down=self.backend == 'onnx')
+
+    #Identity of a model's weights, part of the cache key so outputs of different model files never mix
+    def model_identity(self, model):
+        if model == "mediapipe":
+            return self.model_path
+        if model == "mediapipe-lite":
+            return PROFILES["fast"]
+        #The person detector is float in every ONNX profile
+        if self.backend == 'onnx' and model == "person":
+            return f"{model}:onnx:{self.onnx_dir}"
+        if self.backend == 'onnx':
+            return f"{model}:onnx-{self.onnx_profile}:{self.onnx_dir}"
+        return model
+
+    #Identities of the models a measurement runs, recorded with stored results, output: dict of model -> identity,
+    #and the inference profile
+    def model_versions(self, name):
+        measurement = MEASUREMENTS[name]
+        models = measurement.uses
+        #In ROI crop mode MediaPipe also places the top-down models' regions
+        if self.roi_crop and any(model in measurement.regions for model in models):
+            models.add("mediapipe")
+        versions = {model: self.model_identity(model) for model in MODEL_ORDER if model in models}
+        versions["profile"] = self.profile
+        #Cascade results come from either landmarker, the threshold tells which were kept
+        if self.cascade and "mediapipe" in versions:
+            versions["cascade"] = f"{PROFILES['fast']}<{self.cascade_threshold}"
+        return versions
+
+    #Returns a cached inference output for these pixels and model, or runs compute(pixels) and caches it, region
+    #tells apart outputs of the same model run from different regions of interest
+    def cached_inference(self, model, pixels, compute, region=None):
+        if self.cache is None:
+            return compute(pixels)
+
+        with metrics.stage('cache'):
+            key = (image_digest(pixels), self.model_identity(model), region)
+            hit, result = self.cache.get(key)
+        metrics.CACHE_LOOKUPS.inc(model, 'hit' if hit else 'miss')
+        if not hit:
+            result = compute(pixels)
+            self.cache.put(key, result)
+        return result
+
+    #MediaPipe image inference to gain human landmarks, input: image (RGB array, bytes or path), in cascade mode the
+    #landmark indices the caller reads (without them the profile's landmarker runs straight away), output: landmarks
+    #data
+    def media_pipe_inference(self, image, landmarks=None):
+        pixels = load_image(image)
+        if self.cascade and landmarks:
+            ran = []
+
+            def run_lite(pixels):
+                ran.append(True)
+                return self.run_media_pipe(pixels, lite=True)
+
+            lite = self.cached_inference('mediapipe-lite', pixels, run_lite)
+            kept = self.confident(lite, landmarks)
+            #Only lite landmarker runs are counted, so the escalated share is the rate of fallbacks to the full model
+            #and not of cache lookups
+            if ran:
+                metrics.CASCADE_INFERENCES.inc('kept' if kept else 'escalated')
+            if kept:
+                return lite
+        return self.cached_inference('mediapipe', pixels, self.run_media_pipe)
+
+    #Whether cascade mode keeps the lite landmarker's output: a pose was found and every landmark read has both
+    #visibility and presence at or above the threshold (a score MediaPipe left out counts as the other one)
+    def confident(self, landmarks_data, indices):
+        landmarks, _ = landmarks_data
+        if not landmarks:
+            return False
+        indices = sorted(indices)
+        scores = np.fmin(landmarks.visibility[indices], landmarks.presence[indices])
+        return bool(np.all(scores >= self.cascade_threshold))
+
+    #Runs the MediaPipe landmarker, or cascade mode's lite landmarker, on RGB pixels, bypassing the cache
+    def run_media_pipe(self, pixels, lite=False):
+        import mediapipe as mp
+
+        detector = self.load_media_pipe_lite() if lite else self.load_media_pipe()
+        with metrics.stage('preprocess'):
+            pixels = np.ascontiguousarray(pixels)
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=pixels)
+        with metrics.stage('mediapipe-lite' if lite else 'mediapipe'), self.lite_lock if lite else self.mediapipe_lock:
+            detection_result = detector.detect(mp_image)
+
+        return pose_landmarks(detection_result)
+
+    #MediaPipe landmarker in VIDEO running mode, which tracks the pose from frame to frame instead of detecting it
+    #again on every frame, one per stream as it keeps the stream's tracking state
+    def create_video_landmarker(self):
+        from mediapipe.tasks import python
+        from mediapipe.tasks.python import vision
+
+        options = vision.PoseLandmarkerOptions(
+            base_options=python.BaseOptions(model_asset_path=self.model_path),
+            running_mode=vision.RunningMode.VIDEO)
+        return vision.PoseLandmarker.create_from_options(options)
+
+    #Runs a VIDEO mode landmarker on the next frame of its stream, timestamps must increase from frame to frame,
+    #output: landmarks data as from media_pipe_inference
+    def run_media_pipe_video(self, landmarker, pixels, timestamp_ms):
+        import mediapipe as mp
+
+        with metrics.stage('preprocess'):
+            mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np.ascontiguousarray(pixels))
+        with metrics.stage('mediapipe'):
+            detection_result = landmarker.detect_for_video(mp_image, timestamp_ms)
+        return pose_landmarks(detection_result)
+
+    #Person detection stage shared by wholebody and human3d: the best scoring person box of an image, found once and
+    #handed to each top-down model, input: image (RGB array, bytes or path), output: [x1, y1, x2, y2, score] in
+    #pixels, the whole image with score 1 when nobody is found
+    def person_box(self, image):
+        return self.cached_inference('person', load_image(image), self.run_person_detector)
+
+    #Runs the person detector on RGB pixels, bypassing the cache
+    def run_person_detector(self, pixels):
+        detector = self.load_person_detector()
+        if self.backend == 'onnx':
+            with metrics.stage('person'), self.person_lock:
+                return detector.detect([pixels])[0].tolist()
+
+        with metrics.stage('preprocess'):
+            bgr = to_bgr(pixels)
+        with metrics.stage('person'), self.person_lock:
+            result = detector(bgr, return_datasamples=True)
+        instances = result['predictions'][0].pred_instances.cpu().numpy()
+
+        #NMS always keeps the top box, which is the box MMPose's predictions[0] comes from
+        people = np.flatnonzero((instances.labels == 0) & (instances.scores > PERSON_SCORE))
+        if not len(people):
+            height, width = pixels.shape[:2]
+            return [0.0, 0.0, float(width), float(height), 1.0]
+        best = people[np.argmax(instances.scores[people])]
+        return [*instances.bboxes[best].tolist(), float(instances.scores[best])]
+
+    #Region of interest of a top-down model on one image in ROI crop mode: the box around the MediaPipe landmarks the
+    #measurements read with it, widened by the margin, input: image, model, measurement names, the image's MediaPipe
+    #output when already run, output: (box as from person_box, landmark indices as the cache region), (None, None)
+    #when not in ROI crop mode, a measurement needs the whole photo or MediaPipe finds no pose
+    def model_box(self, image, model, measurements, landmarks=None):
+        if not self.roi_crop:
+            return None, None
+        indices = set()
+        for name in measurements:
+            if model not in MEASUREMENTS[name].regions:
+                return None, None
+            indices.update(MEASUREMENTS[name].regions[model])
+
+        pixels = load_image(image)
+        image_landmarks, _ = landmarks or self.media_pipe_inference(pixels, indices)
+        if not image_landmarks:
+            return None, None
+
+        with metrics.stage('roi'):
+            height, width = pixels.shape[:2]
+            indices = sorted(indices)
+            points = image_landmarks.xyz[indices, :2].astype(np.float64) * (width, height)
+            (left, top), (right, bottom) = points.min(axis=0).tolist(), points.max(axis=0).tolist()
+            margin = self.roi_margin * max(right - left, bottom - top)
+            box = [
+                max(left - margin, 0.0), max(top - margin, 0.0),
+                min(right + margin, float(width)), min(bottom + margin, float(height)), 1.0,
+            ]
+        #Landmarks MediaPipe placed outside the photo leave nothing to crop
+        if box[2] <= box[0] or box[3] <= box[1]:
+            return None, None
+        return box, tuple(indices)
+
+    #MMPose with wholebody image inference to gain human keypoints, input: image (RGB array, bytes or path), person box
+    #(found when not given), its region from model_box, output: keypoints data (in the original image's pixel
+    #coordinates when it was reduced at decode time)
+    def wholebody_inference(self, image, box=None, region=None):
+        pixels = load_image(image)
+        keypoints = self.cached_inference(
+            'wholebody', pixels, lambda pixels: self.run_wholebody(pixels, box), region)
+        return to_original_coordinates(pixels, keypoints)
+
+    #Runs wholebody on RGB pixels from a person box, through the micro-batcher when enabled, bypassing the cache
+    def run_wholebody(self, pixels, box=None):
+        if box is None:
+            box = self.person_box(pixels)
+        if self.wholebody_batcher:
+            with metrics.stage('wholebody'):
+                return self.wholebody_batcher((pixels, box))
+
+        inferencer = self.load_wholebody()
+        if self.backend == 'onnx':
+            with metrics.stage('wholebody'), self.wholebody_lock:
+                return inferencer.predict([pixels], np.array([box]))[0]
+
+        with metrics.stage('preprocess'):
+            bgr = to_bgr(pixels)
+        with metrics.stage('wholebody'), self.wholebody_lock:
+            self.wholebody_box.box = box
+            #Only the keypoints are read, MMPose's visualization is left off
+            result_generator = inferencer(bgr, draw_bbox=False)
+            result = next(result_generator)
 
         keypoints = result['predictions'][0][0]['keypoints'] #Extracting keypoint data
 
         return keypoints
 
-    #MMPose with human3d image inference to gain human keypoints, input: image path, output: keypoints data
-    def human3d_inference(self, input_path):
-        result_generator = self.inferencer_3d(input_path, draw_bbox=True) #Draw bounding boxes around humans
-        result = next(result_generator)
+    #MMPose with human3d image inference to gain human keypoints, input: image (RGB array, bytes or path), person box
+    #(found when not given), its region from model_box, output: keypoints data
+    def human3d_inference(self, image, box=None, region=None):
+        return self.cached_inference(
+            'human3d', load_image(image), lambda pixels: self.run_human3d(pixels, box), region)
+
+    #Runs human3d on RGB pixels from a person box, bypassing the cache
+    def run_human3d(self, pixels, box=None):
+        if box is None:
+            box = self.person_box(pixels)
+
+        inferencer = self.load_human3d()
+        if self.backend == 'onnx':
+            with metrics.stage('human3d'), self.human3d_lock:
+                return inferencer.predict([pixels], np.array([box]))[0]
+
+        with metrics.stage('preprocess'):
+            bgr = to_bgr(pixels)
+        with metrics.stage('human3d'), self.human3d_lock:
+            self.human3d_box.box = box
+            result_generator = inferencer(bgr, draw_bbox=False)
+            result = next(result_generator)
 
         keypoints = result['predictions'][0][0]['keypoints'] #Extracting keypoint data
         return keypoints
 
-    #Calculates the tragus (ear) to wall distance using z coordinates of the head and base of the neck keypoints
-    def tragus_to_wall_left(self, input_path): #human3d
-        predictions = self.human3d_inference(input_path)
-        result = abs(predictions[10][2]-predictions[8][2])
-
-        return round(result * 100, 1) #Rounded to 1dp
-
-    #Calculates the tragus (ear) to wall distance using z coordinates of the head and base of the neck keypoints
-    def tragus_to_wall_right(self, input_path): #human3d
-        predictions = self.human3d_inference(input_path)
-        result = abs(predictions[10][2]-predictions[8][2])
-
-        return round(result * 100, 1) #Rounded to 1dp
-
-    #A helper function for determining the pixel size to calibrate images
-    def side_helper_calibration(self, image_shape, landmarks_data, world_landmarks_data):
-        #Calculates the pixel size of shoulder to toe distance
-        shoulder = landmarks_data[11]
-        toe = landmarks_data[31]
-        h, w = image_shape
-        shoulder_coord = [int(shoulder["x"] * w), int(shoulder["y"] * h)]
-        toe_coord = [int(toe["x"] * w), int(toe["y"] * h)]
-        pixel_distance = math.dist(shoulder_coord, toe_coord)
-
-        #Calculates the world size of shoulder to toe distance
-        shoulder_world = world_landmarks_data[11]
-        toe_world = world_landmarks_data[31]
-        shoulder_point = [shoulder_world["x"], shoulder_world["y"], shoulder_world["z"]]
-        toe_point = [toe_world["x"], toe_world["y"], toe_world["z"]]
-        world_distance = euclidean_distance(shoulder_point, toe_point)
-
-        return world_distance / pixel_distance
-
-    #Calculates the difference in distance between the middle finger and floor before and after side flexing on the left
-    def side_flexion_left(self, before_input_path, after_input_path): #MediaPipe
-        before_landmarks_data, before_world_landmarks_data = self.media_pipe_inference(before_input_path)
-        after_landmarks_data, after_world_landmarks_data = self.media_pipe_inference(after_input_path)
-
-        h_before = before_landmarks_data[17]
-        f_before = before_landmarks_data[31]
-        image = cv2.imread(before_input_path)
-        h, w, _ = image.shape
-        h_y = int(h_before["y"] * h)
-        f_y = int(f_before["y"] * h)
-        pixel_distance = abs(h_y - f_y)
-        pixel_size = self.side_helper_calibration((h, w), before_landmarks_data, before_world_landmarks_data)
-        before = pixel_distance * pixel_size
-
-        h_after = after_landmarks_data[17]
-        f_after = after_landmarks_data[31]
-        image = cv2.imread(after_input_path)
-        h, w, _ = image.shape
-        h_y = int(h_after["y"] * h)
-        f_y = int(f_after["y"] * h)
-        pixel_distance = abs(h_y - f_y)
-        pixel_size = self.side_helper_calibration((h, w), after_landmarks_data, after_world_landmarks_data)
-        after = pixel_distance * pixel_size
-
-        result = before - after
-
-        return abs(round(result*100, 1))
-
-    #Calculates the difference in distance between the middle finger and floor before and after side flexing on the right
-    def side_flexion_right(self, before_input_path, after_input_path): #MediaPipe
-        before_landmarks_data, before_world_landmarks_data = self.media_pipe_inference(before_input_path)
-        after_landmarks_data, after_world_landmarks_data = self.media_pipe_inference(after_input_path)
-
-        h_before = before_landmarks_data[18]
-        f_before = before_landmarks_data[32]
-        image = cv2.imread(before_input_path)
-        h, w, _ = image.shape
-        h_y = int(h_before["y"] * h)
-        f_y = int(f_before["y"] * h)
-        pixel_distance = abs(h_y - f_y)
-        pixel_size = self.side_helper_calibration((h, w), before_landmarks_data, before_world_landmarks_data)
-        before = pixel_distance * pixel_size
-
-        h_after = after_landmarks_data[18]
-        f_after = after_landmarks_data[32]
-        image = cv2.imread(after_input_path)
-        h, w, _ = image.shape
-        h_y = int(h_after["y"] * h)
-        f_y = int(f_after["y"] * h)
-        pixel_distance = abs(h_y - f_y)
-        pixel_size = self.side_helper_calibration((h, w), after_landmarks_data, after_world_landmarks_data)
-        after = pixel_distance * pixel_size
-
-        result = before - after
-
-        return abs(round(result*100, 1))
-
-    #Participants shin left estimated using MediaPipe's inference to calibrate wholebody's 2D lumbar flexion calculation
-    def lumbar_helper_calibration(self, predictions, shin_length):
-        model_shin = distance_between_points(predictions[14], predictions[16])
-        ratio = model_shin / shin_length
-
-        return ratio
-
-    #Calculates the difference in distance between the middle finger and floor before and after flexing forward
-    def lumbar_flexion(self, before_input_path, after_input_path): #wholebody
-        #Estimate shin length with MediaPipe
-        _, world_landmark_data = self.media_pipe_inference(before_input_path)
-        kneecap = world_landmark_data[25]
-        ankle = world_landmark_data[27]
-        kneecap_point = [kneecap["x"], kneecap["y"], kneecap["z"]]
-        ankle_point = [ankle["x"], ankle["y"], ankle["z"]]
-        shin_length = euclidean_distance(kneecap_point, ankle_point)
-        shin_length = shin_length * 100
-
-        before_predictions = self.wholebody_inference(before_input_path)
-        after_predictions = self.wholebody_inference(after_input_path)
-
-        lh_before = before_predictions[104]
-        lf_before = before_predictions[18]
-
-        lh_after = after_predictions[104]
-        lf_after = after_predictions[18]
-
-        rh_before = before_predictions[125]
-        rf_before = before_predictions[21]
-
-        rh_after = after_predictions[125]
-        rf_after = after_predictions[21]
-
-        left_distance_before = lf_before[1] - lh_before[1]
-        right_distance_before = rf_before[1] - rh_before[1]
-        before_ratio = self.lumbar_helper_calibration(before_predictions, shin_length)
-        left_before = left_distance_before / before_ratio
-        right_before = right_distance_before / before_ratio
-
-        left_distance_after = lf_after[1] - lh_after[1]
-        right_distance_after = rf_after[1] - rh_after[1]
-        after_ratio = self.lumbar_helper_calibration(after_predictions, shin_length)
-        left_after = left_distance_after / after_ratio
-        right_after = right_distance_after / after_ratio
-
-        left = left_before - left_after
-        right = right_before - right_after
-
-        return abs(round(left, 1)), abs(round(right,1))
-
-    #Calculates the cervical rotation when patient rotates head as far as possible, generalised the left/right measurements
-    def cervical_helper(self, before_input_path, after_input_path): #MediaPipe
-        _, before_world_landmark_data = self.media_pipe_inference(before_input_path)
-        _, after_world_landmark_data = self.media_pipe_inference(after_input_path)
-        left_shoulder_before = before_world_landmark_data[11]
-        right_shoulder_before = before_world_landmark_data[12]
-        shoulder_midpoint_before = [
-            (left_shoulder_before["x"] + right_shoulder_before['x'])/2,
-            (left_shoulder_before["y"] + right_shoulder_before['y'])/2,
-            (left_shoulder_before["z"] + right_shoulder_before['z'])/2
-        ]
-
-        nose_before = before_world_landmark_data[0]
-        translated_nose_before = [
-            nose_before["x"] - shoulder_midpoint_before[0],
-            nose_before["y"] - shoulder_midpoint_before[1],
-            nose_before["z"] - shoulder_midpoint_before[2]
-        ]
-
-        left_shoulder_after = after_world_landmark_data[11]
-        right_shoulder_after = after_world_landmark_data[12]
-        shoulder_midpoint_after = [
-            (left_shoulder_after["x"] + right_shoulder_after['x'])/2,
-            (left_shoulder_after["y"] + right_shoulder_after['y'])/2,
-            (left_shoulder_after["z"] + right_shoulder_after['z'])/2
-        ]
-
-        nose_after = after_world_landmark_data[0]
-        translated_nose_after = [
-            nose_after["x"] - shoulder_midpoint_after[0],
-            nose_after["y"] - shoulder_midpoint_after[1],
-            nose_after["z"] - shoulder_midpoint_after[2]
-        ]
-
-        dot_product = translated_nose_before[0] * translated_nose_after[0] + translated_nose_before[2] * translated_nose_after[2]
-        magnitude_before = math.sqrt(translated_nose_before[0] ** 2 + translated_nose_before[2] ** 2)
-        magnitude_after = math.sqrt(translated_nose_after[0] ** 2 + translated_nose_after[2] ** 2)
-        rad_angle = math.acos(dot_product/(magnitude_before*magnitude_after))
-
-        angle = math.degrees(rad_angle)
-
-        return abs(round(angle,1))
-
-    #Left cervical rotation measurement, using helper function
-    def cervical_rotation_left(self, before_input_path, after_input_path): #MediaPipe
-        result = self.cervical_helper(before_input_path, after_input_path)
-        return result
+    #Batched wholebody inference: the pose model runs one forward pass over every person box in the batch, input: list
+    #of (image, person box) pairs, output: list of keypoints data in the same order
+    def wholebody_inference_batch(self, items):
+        images = [load_image(image) for image, _ in items]
+        boxes = [box for _, box in items]
+        #The exported models take a batch dimension, every image and box goes through one run
+        if self.backend == 'onnx':
+            inferencer = self.load_wholebody()
+            with self.wholebody_lock:
+                return inferencer.predict(images, np.array(boxes))
+
+        #MMPoseInferencer.__call__ only ever feeds the model one image at a time, so the Pose2DInferencer steps are
+        #driven directly: preprocess each image, collate all boxes together, forward once, then split per image
+        from mmpose.structures import merge_data_samples, split_instances
+
+        pose2d = self.load_wholebody().inferencer
+        bgr_images = [to_bgr(image) for image in images]
+        with self.wholebody_lock:
+            data_infos = []
+            counts = []
+            for index, (bgr, box) in enumerate(zip(bgr_images, boxes)):
+                self.wholebody_box.box = box
+                instances = pose2d.preprocess_single(bgr, index=index)
+                counts.append(len(instances))
+                data_infos.extend(instances)
+            data_samples = pose2d.forward(pose2d.collate_fn(data_infos), merge_results=False)
+
+        keypoints = []
+        start = 0
+        for count in counts:
+            merged = merge_data_samples(data_samples[start:start + count])
+            start += count
+            keypoints.append(split_instances(merged.pred_instances)[0]['keypoints']) #Extracting keypoint data
 
-    #Right cervical rotation measurement, using helper function
-    def cervical_rotation_right(self, before_input_path, after_input_path): #MediaPipe
-        result = self.cervical_helper(before_input_path, after_input_path)
-        return result
+        return keypoints
 
-    #Calculates the distance between patients ankles when legs moved apart as far as possible
-    def intermalleolar_distance(self, input_path): #MediaPipe
-        _, world_landmark_data = self.media_pipe_inference(input_path)
-        left_ankle = world_landmark_data[29]
-        right_ankle = world_landmark_data[30]
-        left_point = [left_ankle["x"], left_ankle["y"], left_ankle["z"]]
-        right_point = [right_ankle["x"], right_ankle["y"], right_ankle["z"]]
-        result = euclidean_distance(left_point, right_point)
-        return abs(round(result * 100, 1))
+    #Tragus (ear) to wall distance of each side, from human3d
+    def tragus_to_wall_left(self, image):
+        return self.measure("tragus_to_wall_left", image)
+
+    def tragus_to_wall_right(self, image):
+        return self.measure("tragus_to_wall_right", image)
+
+    #Difference in the finger to floor distance before and after side flexing to each side, from MediaPipe
+    def side_flexion_left(self, before_image, after_image):
+        return self.measure("side_flexion_left", before_image, after_image)
+
+    def side_flexion_right(self, before_image, after_image):
+        return self.measure("side_flexion_right", before_image, after_image)
+
+    #Difference in the fingertip to floor distance before and after flexing forward, from wholebody calibrated by the
+    #MediaPipe shin length
+    def lumbar_flexion(self, before_image, after_image):
+        return self.measure("lumbar_flexion", before_image, after_image)
+
+    #Cervical rotation when the patient turns their head as far as possible to each side, from MediaPipe
+    def cervical_rotation_left(self, before_image, after_image):
+        return self.measure("cervical_rotation_left", before_image, after_image)
+
+    def cervical_rotation_right(self, before_image, after_image):
+        return self.measure("cervical_rotation_right", before_image, after_image)
+
+    #Calculates the distance between patients ankles when legs moved apart as far as possible, from MediaPipe
+    def intermalleolar_distance(self, image):
+        return self.measure("intermalleolar_distance", image)
+
+    #Runs one model on one image, MediaPipe checked on the landmarks read in cascade mode, top-down models from the
+    #given box and region, output: the model's inference result
+    def run_model(self, model, image, box=None, region=None, landmarks=None):
+        if model == "mediapipe":
+            return self.media_pipe_inference(image, landmarks)
+        if model == "wholebody":
+            return self.wholebody_inference(image, box, region)
+        if model == "human3d":
+            return self.human3d_inference(image, box, region)
+        raise ValueError(f"Unknown model: {model}")
+
+    #Computes several measurements over a shared set of images, running each (image, model) inference exactly once,
+    #input: dict of measurement name -> image indices in argument order, images, output: dict of measurement name -> result,
+    #or -> (result, per-image landmark summaries) with summarise
+    def measure_session(self, measurements, *images, summarise=False):
+        images = [load_image(image) for image in images]
+
+        #Dependency graph: which models each image needs across all requested measurements, and for which of them
+        required = plan_models(measurements, len(images))
+        gathers = plan_gathers(measurements, len(images))
+
+        outputs = []
+        for index, image in enumerate(images):
+            output = {"shape": original_shape(image)}
+            models = required[index]
+            if "mediapipe" in models:
+                output["mediapipe"] = self.run_model("mediapipe", image, landmarks=gathers[index]["mediapipe"])
+
+            #Top-down models run from their region of interest in ROI crop mode, otherwise from one person detection
+            #per image shared between them
+            boxes = {
+                model: self.model_box(image, model, models[model], output.get("mediapipe"))
+                for model in MODEL_ORDER if model != "mediapipe" and model in models
+            }
+            person = self.person_box(image) if any(box is None for box, _ in boxes.values()) else None
+            for model, (box, region) in boxes.items():
+                output[model] = self.run_model(model, image, box or person, region)
+            outputs.append(output)
+
+        #Landmarks are gathered once per image for all measurements, then each measurement's kernel runs on them
+        with metrics.stage('measurement'):
+            results = evaluate(measurements, outputs)
+
+        if not summarise:
+            return results
+        return {
+            name: (results[name], [
+                summarise_landmarks(reads, outputs[index]) for index, reads in zip(indices, MEASUREMENTS[name].images)
+            ])
+            for name, indices in measurements.items()
+        }
+
+    #Runs one registered measurement on its images, as its own method, output: its result
+    def measure(self, name, *images):
+        return self.measure_session({name: list(range(len(images)))}, *images)[name]
+
+    #measure_session for the measurement store, output: dict of measurement name -> (result, landmark summaries)
+    def measure_session_with_summary(self, measurements, *images):
+        return self.measure_session(measurements, *images, summarise=True)
+
+    #Runs one measurement like measure and also summarises the landmarks it used, for the measurement store,
+    #input: measurement name, its images, output: (result, per-image landmark summaries)
+    def measure_with_summary(self, name, *images):
+        return self.measure_session_with_summary({name: list(range(len(images)))}, *images)[name]
@@ -0,0 +1,7 @@
+import os
+import sys
+
+#The backend modules live at the top level of basmi-backend, the app is imported without loading models or a store
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('BASMI_STARTUP_MODE', 'lazy')
+os.environ.setdefault('BASMI_STORE_PATH', '')
@@ -0,0 +1,94 @@
+import threading
+import time
+from io import BytesIO
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from landmarks import COLUMNS, LEFT_SHOULDER, NOSE, RIGHT_SHOULDER, VISIBILITY, X, Z, Landmarks
+from pose_estimator import PoseEstimator
+
+#PoseEstimator whose tracking landmarker sleeps for a while and turns the head a little further on every frame
+class SlowLiveEstimator(PoseEstimator):
+    def __init__(self, seconds):
+        super().__init__(lazy=True)
+        self.seconds = seconds
+        self.frames = 0
+
+    def create_video_landmarker(self):
+        class Landmarker:
+            def close(self):
+                pass
+        return Landmarker()
+
+    def run_media_pipe_video(self, landmarker, pixels, timestamp_ms):
+        time.sleep(self.seconds)
+        array = np.zeros((33, COLUMNS), dtype=np.float32)
+        array[:, VISIBILITY:] = 1.0
+        array[LEFT_SHOULDER, X], array[RIGHT_SHOULDER, X] = 0.2, -0.2
+        array[NOSE, X], array[NOSE, Z] = 0.02 * self.frames, -0.1
+        self.frames += 1
+        return Landmarks(array), Landmarks(array)
+
+@pytest.fixture
+def client(monkeypatch):
+    estimator = SlowLiveEstimator(0.2)
+    monkeypatch.setattr(main, 'estimator', estimator)
+    main.router.measure_with(estimator)
+    #No lifespan context: a stream stuck on the server must not hold up the client's shutdown
+    return TestClient(main.app)
+
+def jpeg():
+    buffer = BytesIO()
+    Image.new('RGB', (64, 48), (120, 120, 120)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+#Runs a stream on a thread, input: test client, function sending the messages, number of replies to wait for,
+#output: the replies. A stream that never answers fails the test instead of hanging it
+def exchange(client, send, count):
+    replies = []
+
+    def stream():
+        with client.websocket_connect('/live/cervicalleft') as websocket:
+            send(websocket)
+            for _ in range(count):
+                replies.append(websocket.receive_json())
+
+    thread = threading.Thread(target=stream, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive(), f"no final reply after {len(replies)} replies"
+    return replies
+
+#A frame and "end" arriving while the previous frame is still being measured: the pending frame is measured and the
+#peak is still sent
+def test_frame_and_end_while_busy(client):
+    def send(websocket):
+        websocket.send_bytes(jpeg())
+        time.sleep(0.05)
+        websocket.send_bytes(jpeg())
+        websocket.send_text("end")
+
+    replies = exchange(client, send, 3)
+    assert [reply["status"] for reply in replies] == ["success"] * 3
+    assert "value" in replies[0] and "value" in replies[1]
+    assert replies[2]["frames"] == 2
+    assert replies[2]["result"] == replies[1]["peak"]
+
+#Frames that do not decode are dropped and the stream carries on to its peak
+def test_corrupt_frames_are_dropped(client):
+    def send(websocket):
+        websocket.send_text("not-an-image")
+        time.sleep(0.05)
+        websocket.send_bytes(b"not a jpeg")
+        time.sleep(0.05)
+        websocket.send_bytes(jpeg())
+        websocket.send_text("end")
+
+    replies = exchange(client, send, 2)
+    assert [reply["status"] for reply in replies] == ["success"] * 2
+    assert replies[1]["frames"] == 1
+    assert replies[1]["dropped"] == 2
@@ -0,0 +1,140 @@
+import numpy as np
+import pytest
+
+import measurement_kernels as kernels
+from landmarks import (
+    COLUMNS, H36M_HEAD, H36M_JOINTS, H36M_THORAX, LEFT_ANKLE, LEFT_FOOT_INDEX, LEFT_HEEL, LEFT_KNEE, LEFT_PINKY,
+    LEFT_SHOULDER, NOSE, POSE_LANDMARKS, RIGHT_FOOT_INDEX, RIGHT_HEEL, RIGHT_PINKY, RIGHT_SHOULDER, VISIBILITY,
+    WHOLEBODY_KEYPOINTS, WHOLEBODY_LEFT_RING_BASE, WHOLEBODY_LEFT_SMALL_TOE, WHOLEBODY_RIGHT_ANKLE,
+    WHOLEBODY_RIGHT_KNEE, WHOLEBODY_RIGHT_RING_BASE, WHOLEBODY_RIGHT_SMALL_TOE, Landmarks)
+from measurement_registry import MEASUREMENTS, ImageLandmarks, evaluate
+
+#Fixed poses for every measurement. The expected values were computed with the per-image scalar formulas the kernels
+#replaced (PoseEstimator's tragus_helper, side_flexion_helper over finger_floor_distance, lumbar_helper, cervical_angle
+#and intermalleolar_helper), so a kernel that drifts from them by one rounding step fails here
+
+#MediaPipe output of one image, input: dict of landmark index -> normalised (x, y, z) and -> world (x, y, z), image
+#height and width
+def mediapipe(image, world, shape=(1280, 720)):
+    arrays = []
+    for points in (image, world):
+        array = np.zeros((POSE_LANDMARKS, COLUMNS), dtype=np.float32)
+        array[:, VISIBILITY:] = 1.0
+        for index, point in points.items():
+            array[index, :3] = point
+        arrays.append(Landmarks(array))
+    return {"shape": shape, "mediapipe": tuple(arrays)}
+
+#Standing pose seen from the front, the hands lowered by drop (normalised image height)
+def standing(drop=0.0, shape=(1280, 720)):
+    image = {
+        LEFT_SHOULDER: (0.56, 0.22, 0.0), LEFT_FOOT_INDEX: (0.55, 0.92, 0.0), RIGHT_FOOT_INDEX: (0.45, 0.92, 0.0),
+        LEFT_PINKY: (0.59, 0.51 + drop, 0.0), RIGHT_PINKY: (0.41, 0.53 + drop, 0.0),
+    }
+    world = {
+        LEFT_SHOULDER: (0.11, -0.5, 0.0), LEFT_FOOT_INDEX: (0.1, 0.78, -0.08), RIGHT_FOOT_INDEX: (-0.1, 0.78, -0.08),
+        LEFT_KNEE: (0.1, 0.4, 0.0), LEFT_ANKLE: (0.1, 0.82, 0.02),
+        NOSE: (0.0, -0.62, -0.1), RIGHT_SHOULDER: (-0.11, -0.5, 0.0),
+        LEFT_HEEL: (0.12, 0.85, 0.0), RIGHT_HEEL: (-0.12, 0.85, 0.03),
+    }
+    return mediapipe(image, world, shape)
+
+#Head turned: the nose moved to (x, z) in world space, shoulders as in standing
+def turned(x, z):
+    output = standing()
+    world = output["mediapipe"][1].array.copy()
+    world[NOSE, 0], world[NOSE, 2] = x, z
+    output["mediapipe"] = (output["mediapipe"][0], Landmarks(world))
+    return output
+
+#Legs apart: the heels at these world x coordinates
+def apart(left, right):
+    output = standing()
+    world = output["mediapipe"][1].array.copy()
+    world[LEFT_HEEL, 0], world[RIGHT_HEEL, 0] = left, right
+    output["mediapipe"] = (output["mediapipe"][0], Landmarks(world))
+    return output
+
+#human3d output with the head this far in front of the base of the neck, in metres
+def human3d(depth):
+    keypoints = [[0.0, 0.0, index * 0.01] for index in range(H36M_JOINTS)]
+    keypoints[H36M_THORAX] = [0.0, -0.5, 0.05]
+    keypoints[H36M_HEAD] = [0.0, -0.7, 0.05 + depth]
+    return {"shape": (1280, 720), "human3d": keypoints}
+
+#wholebody keypoints in pixels with the ring finger bases lowered by drop, right knee at knee, plus the MediaPipe shin
+def wholebody(drop, knee=(320.0, 700.0)):
+    keypoints = [[300.0 + index % 10 * 5, 100.0 + index * 6] for index in range(WHOLEBODY_KEYPOINTS)]
+    keypoints[WHOLEBODY_RIGHT_KNEE], keypoints[WHOLEBODY_RIGHT_ANKLE] = list(knee), [321.5, 883.0]
+    keypoints[WHOLEBODY_LEFT_SMALL_TOE], keypoints[WHOLEBODY_RIGHT_SMALL_TOE] = [310.0, 921.0], [330.0, 919.5]
+    keypoints[WHOLEBODY_LEFT_RING_BASE] = [300.0, 500.0 + drop]
+    keypoints[WHOLEBODY_RIGHT_RING_BASE] = [340.0, 503.25 + drop]
+    output = standing()
+    output["wholebody"] = keypoints
+    return output
+
+#(measurement, per-image outputs, result of the scalar formulas)
+SESSIONS = [
+    ("tragus_to_wall_left", [human3d(0.07)], 7.0),
+    ("tragus_to_wall_right", [human3d(-0.0423)], 4.2),
+    #Products landing next to a half, the first four round the other way with np.round alone
+    ("tragus_to_wall_left", [human3d(0.0085)], 0.9),
+    ("tragus_to_wall_left", [human3d(0.0315)], 3.1),
+    ("tragus_to_wall_left", [human3d(0.0345)], 3.5),
+    ("tragus_to_wall_right", [human3d(0.0465)], 4.7),
+    ("tragus_to_wall_left", [human3d(0.0125)], 1.2),
+    ("tragus_to_wall_left", [human3d(0.0135)], 1.3),
+    ("tragus_to_wall_right", [human3d(0.0005)], 0.1),
+    ("side_flexion_left", [standing(), standing(0.2)], 36.6),
+    ("side_flexion_right", [standing(), standing(0.17)], 31.1),
+    ("side_flexion_left", [standing(shape=(1920, 1080)), standing(0.1, shape=(1280, 720))], 18.3),
+    ("lumbar_flexion", [wholebody(0.0), wholebody(250.0)], (57.4, 57.4)),
+    ("lumbar_flexion", [wholebody(10.0), wholebody(137.5, knee=(320.0, 690.0))], (32.7, 32.6)),
+    ("cervical_rotation_left", [standing(), turned(0.07, -0.07)], 45.0),
+    ("cervical_rotation_right", [standing(), turned(-0.1, -0.02)], 78.7),
+    ("cervical_rotation_left", [standing(), standing()], 0.0),
+    ("intermalleolar_distance", [apart(0.3, -0.3)], 60.1),
+    ("intermalleolar_distance", [apart(0.1225, -0.1225)], 24.7),
+]
+
+#Poses the scalar formulas could not measure (a division by zero), NaN or inf in the kernels
+DEGENERATE = [
+    #Shoulder on the toe: no pixel calibration
+    ("side_flexion_left", [mediapipe({}, {}), standing(0.1)]),
+    #Nose on the shoulder midpoint: no head direction
+    ("cervical_rotation_left", [standing(), turned(0.0, 0.0)]),
+    #Knee on the ankle: no wholebody shin
+    ("lumbar_flexion", [wholebody(0.0, knee=(321.5, 883.0)), wholebody(200.0)]),
+]
+
+@pytest.mark.parametrize("name, outputs, expected", SESSIONS)
+def test_matches_scalar_formulas(name, outputs, expected):
+    assert evaluate({name: list(range(len(outputs)))}, outputs)[name] == expected
+
+@pytest.mark.parametrize("name, outputs", DEGENERATE)
+def test_degenerate_pose_raises(name, outputs):
+    with pytest.raises(ValueError):
+        evaluate({name: list(range(len(outputs)))}, outputs)
+
+#Kernels over many sessions at once give each session the result it gets alone, a degenerate row only spoils itself
+@pytest.mark.parametrize("name", sorted(MEASUREMENTS))
+def test_batched_rows_match_single_sessions(name):
+    sessions = [outputs for session, outputs, _ in SESSIONS if session == name]
+    sessions += [outputs for session, outputs in DEGENERATE if session == name]
+    measurement = MEASUREMENTS[name]
+    batched = measurement.formula(*[
+        ImageLandmarks.from_outputs([outputs[image] for outputs in sessions], reads)
+        for image, reads in enumerate(measurement.images)
+    ])
+    for row, outputs in enumerate(sessions):
+        single = measurement.formula(*[
+            ImageLandmarks.from_outputs([output], reads) for output, reads in zip(outputs, measurement.images)
+        ])[0]
+        np.testing.assert_array_equal(batched[row], single)
+
+#round_like_python agrees with round() next to halves, where x * 10 is not exactly what NumPy rounds
+def test_round_like_python():
+    values = [0.05, 0.15, 0.25, 0.35, 0.45, 1.45, 2.675, 0.0049999, 12.25, 12.35, 123.45, -0.15, -2.65]
+    values += [step / 20 for step in range(-200, 200)]
+    np.testing.assert_array_equal(kernels.round_like_python(values, 1), [round(value, 1) for value in values])
+    np.testing.assert_array_equal(kernels.round_like_python(values, 2), [round(value, 2) for value in values])
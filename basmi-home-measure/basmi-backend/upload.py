@@ -0,0 +1,133 @@
+try:
+    from python_multipart.exceptions import FormParserError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+    from multipart.exceptions import FormParserError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+#Raised when a request body is larger than the configured limit
+class UploadTooLargeError(Exception):
+    pass
+
+#Raised when a request body cannot be read as the expected images
+class UploadFormatError(Exception):
+    pass
+
+#Streams the request body into a single buffer without ever holding more than max_bytes,
+#input: request, byte limit, output: bytearray holding the body
+async def read_body(request, max_bytes):
+    content_length = request.headers.get('content-length')
+    if content_length is not None:
+        size = int(content_length)
+        if size > max_bytes:
+            raise UploadTooLargeError(f"Upload of {size} bytes exceeds the {max_bytes} byte limit")
+        #Known length: allocate once and copy each chunk into place
+        buffer = bytearray(size)
+        view = memoryview(buffer)
+        received = 0
+        async for chunk in request.stream():
+            end = received + len(chunk)
+            if end > size:
+                raise UploadFormatError("Body is longer than its Content-Length")
+            view[received:end] = chunk
+            received = end
+        view.release()
+        if received != size:
+            raise UploadFormatError("Body is shorter than its Content-Length")
+        return buffer
+
+    #Chunked upload: grow the buffer but stop reading as soon as the limit is passed
+    buffer = bytearray()
+    async for chunk in request.stream():
+        if len(buffer) + len(chunk) > max_bytes:
+            raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit")
+        buffer += chunk
+    return buffer
+
+#Splits a multipart/form-data body into its fields without copying the part data,
+#input: body buffer, multipart boundary, output: dict of field name -> memoryview
+def parse_multipart(body, boundary):
+    fields = {}
+    body_view = memoryview(body)
+    state = {"header_field": b"", "header_value": b"", "name": None, "pieces": []}
+
+    def on_header_field(data, start, end):
+        state["header_field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["header_value"] += data[start:end]
+
+    def on_header_end():
+        if state["header_field"].lower() == b"content-disposition":
+            _, options = parse_options_header(state["header_value"])
+            state["name"] = options.get(b"name", b"").decode('latin-1')
+        state["header_field"] = b""
+        state["header_value"] = b""
+
+    def on_part_begin():
+        state["name"] = None
+        state["pieces"] = []
+
+    def on_part_data(data, start, end):
+        #Data normally points into the body buffer, keep a view rather than a copy
+        if data is body:
+            state["pieces"].append(body_view[start:end])
+        else:
+            state["pieces"].append(bytes(data[start:end]))
+
+    def on_part_end():
+        pieces = state["pieces"]
+        if state["name"]:
+            fields[state["name"]] = pieces[0] if len(pieces) == 1 else memoryview(b"".join(pieces))
+
+    parser = MultipartParser(boundary, {
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        parser.write(body)
+        parser.finalize()
+    except FormParserError as exc:
+        raise UploadFormatError(f"Malformed multipart body: {exc}") from exc
+    return fields
+
+#Extracts the encoded images a measurement needs from a raw or multipart body,
+#input: content type header, body buffer, image field names, output: list of encoded images in field order
+def extract_images(content_type, body, image_fields):
+    media_type, options = parse_options_header(content_type)
+    if media_type == b"multipart/form-data":
+        boundary = options.get(b"boundary")
+        if not boundary:
+            raise UploadFormatError("Multipart body has no boundary")
+        fields = parse_multipart(body, boundary)
+        missing = [name for name in image_fields if name not in fields or not len(fields[name])]
+        if missing:
+            raise UploadFormatError(f"Missing image fields: {', '.join(missing)}")
+        return [fields[name] for name in image_fields]
+
+    #Raw image body: only possible for measurements that take a single image
+    if media_type.startswith(b"image/") or media_type == b"application/octet-stream":
+        if len(image_fields) != 1:
+            raise UploadFormatError(f"This measurement needs multipart fields: {', '.join(image_fields)}")
+        if not body:
+            raise UploadFormatError("No image data received")
+        return [memoryview(body)]
+
+    raise UploadFormatError("Send an image/* body or multipart/form-data")
+
+#Extracts an uploaded clip from a raw video/* body or the "video" field of a multipart body, output: encoded video
+def extract_video(content_type, body):
+    media_type, _ = parse_options_header(content_type)
+    if media_type == b"multipart/form-data":
+        return extract_images(content_type, body, ("video",))[0]
+
+    if media_type.startswith(b"video/") or media_type == b"application/octet-stream":
+        if not body:
+            raise UploadFormatError("No video data received")
+        return memoryview(body)
+
+    raise UploadFormatError("Send a video/* body or multipart/form-data")
@@ -0,0 +1,147 @@
+import math
+import os
+import tempfile
+
+import metrics
+from landmarks import LEFT_FOOT_INDEX, LEFT_INDEX, LEFT_PINKY, RIGHT_FOOT_INDEX, RIGHT_INDEX, RIGHT_PINKY, Y
+from measurement_registry import MEASUREMENTS, evaluate
+from upload import UploadFormatError
+
+#Where a frame is in the movement according to the quick scan, larger is further from the neutral position,
+#input: the frame's MediaPipe output (plus the scanned frame's "shape"), the first output with a pose
+def _fingertips_lowered(output, first_output):
+    landmarks_data = output["mediapipe"][0]
+    return (landmarks_data.value(LEFT_INDEX, Y) + landmarks_data.value(RIGHT_INDEX, Y)) / 2
+
+def _side_flexion_signal(hand, foot):
+    def signal(output, first_output):
+        landmarks_data = output["mediapipe"][0]
+        return landmarks_data.value(hand, Y) - landmarks_data.value(foot, Y)
+    return signal
+
+#The registered measurement itself, of the frame alone or against the first frame with a pose as the neutral position
+def _measured(method):
+    def signal(output, first_output):
+        if len(MEASUREMENTS[method].images) == 1:
+            return evaluate({method: [0]}, [output])[method]
+        if output is first_output:
+            return 0.0
+        return evaluate({method: [0, 1]}, [first_output, output])[method]
+    return signal
+
+#Movement measurements that can be taken from a clip, PoseEstimator method -> movement signal
+VIDEO_SIGNALS = {
+    "side_flexion_left": _side_flexion_signal(LEFT_PINKY, LEFT_FOOT_INDEX),
+    "side_flexion_right": _side_flexion_signal(RIGHT_PINKY, RIGHT_FOOT_INDEX),
+    "lumbar_flexion": _fingertips_lowered,
+    "cervical_rotation_left": _measured("cervical_rotation_left"),
+    "cervical_rotation_right": _measured("cervical_rotation_right"),
+    "intermalleolar_distance": _measured("intermalleolar_distance"),
+}
+
+#Quick pass over the clip: decodes only every stride-th frame's pixels, reduces it and tracks it with a VIDEO mode
+#landmarker, input: estimator, video path, frames per second to sample, longest side of the sampled frames, seconds
+#to read at most, gap in frames from which to seek instead of reading through, output: list of (frame index,
+#MediaPipe output with the scanned frame's "shape") for frames with a pose
+def scan_video(estimator, path, scan_fps, scan_side, max_seconds, seek_frames):
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise UploadFormatError("Could not read the video")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    stride = max(1, round(fps / scan_fps))
+    landmarker = estimator.create_video_landmarker()
+    poses = []
+    try:
+        #grab() decodes every frame it passes (inter frames need the ones before them), retrieve() only converts the
+        #sampled one. A seek restarts decoding from the keyframe before the target, so it only pays off for gaps
+        #longer than the clip's keyframe interval
+        position = 0
+        for index in range(0, math.ceil(max_seconds * fps), stride):
+            with metrics.stage('decode'):
+                if seek_frames and index - position >= seek_frames:
+                    capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+                    position = index
+                ok = True
+                while ok and position <= index:
+                    ok = capture.grab()
+                    position += 1
+                if ok:
+                    ok, frame = capture.retrieve()
+                if not ok:
+                    break
+                height, width = frame.shape[:2]
+                scale = min(1.0, scan_side / max(height, width))
+                frame = cv2.resize(
+                    frame, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            landmarks_data, world_landmarks_data = estimator.run_media_pipe_video(
+                landmarker, frame, int(index * 1000 / fps))
+            if world_landmarks_data:
+                poses.append((index, {
+                    "shape": frame.shape[:2], "mediapipe": (landmarks_data, world_landmarks_data)}))
+    finally:
+        landmarker.close()
+        capture.release()
+    return poses
+
+#Start and peak frames of the movement from the scan, input: PoseEstimator method, scanned poses, number of images the
+#method takes, output: frame indices in the method's argument order, None when no frame could be measured
+def select_keyframes(method, poses, images):
+    signal = VIDEO_SIGNALS[method]
+    first_output = poses[0][1]
+    values = []
+    for index, output in poses:
+        try:
+            values.append((signal(output, first_output), index))
+        #Degenerate poses are left out like frames without a pose
+        except ValueError:
+            continue
+    if not values:
+        return None
+
+    peak = max(range(len(values)), key=lambda position: values[position][0])
+    if images == 1:
+        return [values[peak][1]]
+    #The neutral position is the least moved frame up to the peak
+    start = min(range(peak + 1), key=lambda position: values[position][0])
+    return [values[start][1], values[peak][1]]
+
+#Seeks to and fully decodes the chosen frames, input: video path, frame indices, output: RGB pixels in the same order
+def read_frames(path, indices):
+    import cv2
+
+    capture = cv2.VideoCapture(path)
+    frames = {}
+    try:
+        for index in sorted(set(indices)):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = capture.read()
+            if not ok:
+                raise UploadFormatError(f"Could not read frame {index} of the video")
+            frames[index] = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    finally:
+        capture.release()
+    return [frames[index] for index in indices]
+
+#Measures a movement from a recorded clip: the quick scan picks the start and peak frames and only those are measured
+#at full resolution, the same way as uploaded photos, input: estimator for the scan, measurement function, its
+#PoseEstimator method name and number of images, encoded video, scan settings, output: (result, keyframe indices),
+#or None when no pose was found
+def measure_video(
+        estimator, measurement, method, images, video, scan_fps, scan_side, max_seconds, seek_frames):
+    #OpenCV only reads videos from a path
+    handle, path = tempfile.mkstemp(suffix='.video')
+    try:
+        with os.fdopen(handle, 'wb') as file:
+            file.write(video)
+        poses = scan_video(estimator, path, scan_fps, scan_side, max_seconds, seek_frames)
+        keyframes = select_keyframes(method, poses, images) if poses else None
+        if keyframes is None:
+            return None
+        with metrics.stage('decode'):
+            frames = read_frames(path, keyframes)
+    finally:
+        os.remove(path)
+    return measurement(*frames), keyframes
@@ -0,0 +1,139 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+import metrics
+from image_io import ScaledImage
+
+#Estimator inherited by the forked workers, set before the first fork so the loaded weights are shared copy-on-write
+_estimator = None
+#Released by each worker once its initialiser has finished, so a pool is only handed out with every worker ready
+_ready = None
+
+#Image pixels copied once into shared memory, only the block name, shape and dtype (and the original shape of a
+#reduced image) are pickled to a worker
+class SharedImage:
+    def __init__(self, array):
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self.original_shape = getattr(array, 'original_shape', None)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.name = self.shm.name
+        np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)[...] = array
+
+    def __getstate__(self):
+        return {"name": self.name, "shape": self.shape, "dtype": self.dtype, "original_shape": self.original_shape}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = None
+
+    #Parent side: free the block once the worker has finished with it
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+#Runs in each worker once after fork, warm_up: run the warm-up inferences of the models rebuilt after the fork
+def _init_worker(threads, warm_up):
+    try:
+        try:
+            import torch
+            torch.set_num_threads(threads)
+        except ImportError:
+            pass
+        import cv2
+        cv2.setNumThreads(threads)
+        _estimator.after_fork(threads)
+        if warm_up:
+            _estimator.warm_up_after_fork()
+    finally:
+        _ready.release()
+
+#Array view over a shared image's block, keeping the original shape of a reduced image
+def _attach_array(image, shm):
+    array = np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)
+    if image.original_shape is None:
+        return array
+    array = array.view(ScaledImage)
+    array.original_shape = image.original_shape
+    return array
+
+#Worker side: opens a shared image's block. Attaching registers the block with the resource tracker again (before
+#Python 3.13), which the parent's unlink never clears, so it would be reported as leaked and unlinked a second time at
+#shutdown. The parent owns the block, the worker's registration is dropped
+def _attach(image):
+    shm = shared_memory.SharedMemory(name=image.name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+#Runs in a worker: maps shared images back to arrays without copying and calls the estimator method,
+#output: the method's result and the metric observations made while computing it
+def _run(method_name, args, endpoint):
+    attached = [_attach(arg) if isinstance(arg, SharedImage) else None for arg in args]
+    resolved = [
+        _attach_array(arg, shm) if shm else arg
+        for arg, shm in zip(args, attached)
+    ]
+    token = metrics.ENDPOINT.set(endpoint)
+    try:
+        with metrics.capture() as observations:
+            result = getattr(_estimator, method_name)(*resolved)
+        return result, observations
+    finally:
+        metrics.ENDPOINT.reset(token)
+        #Views must be dropped before the blocks can be closed
+        resolved.clear()
+        for shm in attached:
+            if shm:
+                shm.close()
+
+#Pool of forked processes, each with its own copy of the PoseEstimator models, used in place of a PoseEstimator
+class ProcessEstimatorPool:
+    def __init__(self, estimator, processes, threads_per_process=1, warm_up=False):
+        global _estimator, _ready
+        _estimator = estimator
+        context = multiprocessing.get_context('fork')
+        _ready = context.Semaphore(0)
+        self.processes = processes
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(threads_per_process, warm_up),
+        )
+        #Forking workers happens on first submit, do it now while the models are freshly loaded and nothing is in flight
+        self.executor.submit(len, ()).result()
+        #Every worker, not just the one that ran the first task, has rebuilt (and warmed up) its models
+        for _ in range(processes):
+            _ready.acquire()
+
+    #Runs estimator.method_name(*args) in a worker process, RGB arrays travel through shared memory,
+    #the future's result is (result, metric observations)
+    def submit(self, method_name, *args):
+        shared = [SharedImage(arg) if isinstance(arg, np.ndarray) else arg for arg in args]
+        future = self.executor.submit(_run, method_name, shared, metrics.ENDPOINT.get())
+
+        def release(_):
+            for arg in shared:
+                if isinstance(arg, SharedImage):
+                    arg.release()
+
+        future.add_done_callback(release)
+        return future
+
+    #Measurement methods are proxied so the pool can stand in for a PoseEstimator, e.g. pool.lumbar_flexion(a, b)
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        def call(*args):
+            result, observations = self.submit(name, *args).result()
+            metrics.REGISTRY.replay(observations)
+            return result
+
+        return call
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)